@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Regresión de N+1 en GET /compras/historial/{usuario_id}.
+
+Crea una base SQLite temporal con un usuario con cientos de compras, pide el
+historial con distintos tamaños de página y cuenta las sentencias SQL que
+ejecuta cada request. El número debe ser constante (no crecer con las filas
+devueltas); si no lo es, el script termina con código 1.
+
+Uso:
+    python benchmarks/historial_consultas.py --compras 500
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compras", type=int, default=500)
+    parser.add_argument("--productos", type=int, default=20)
+    args = parser.parse_args()
+
+    # La base de datos se elige al importar `database`: configurarla antes
+    directorio = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'historial.db')}"
+    sys.path.insert(0, RAIZ)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import main as app_main
+    from database import SessionLocal, async_engine
+    from models import Compra, Producto, Usuario
+
+    with SessionLocal() as db:
+        usuario = Usuario(nombre="historial", email="historial@example.com", password_hash="", cleanpoints=0)
+        productos = [
+            Producto(nombre=f"producto {i}", precio=10 + i, categoria="eco", imagen="x.png")
+            for i in range(args.productos)
+        ]
+        db.add(usuario)
+        db.add_all(productos)
+        db.flush()
+        inicio = datetime.utcnow() - timedelta(days=args.compras)
+        db.add_all([
+            Compra(
+                usuario_id=usuario.id,
+                producto_id=productos[i % len(productos)].id,
+                precio_pagado=10,
+                descuento_aplicado=0,
+                fecha=inicio + timedelta(days=i),
+            )
+            for i in range(args.compras)
+        ])
+        db.commit()
+        usuario_id = usuario.id
+
+    sentencias = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: sentencias.append(a[2]))
+
+    client = TestClient(app_main.app)
+    conteos = {}
+    for limit in (1, 10, 100):
+        sentencias.clear()
+        r = client.get(f"/compras/historial/{usuario_id}", params={"limit": limit})
+        r.raise_for_status()
+        assert len(r.json()) == limit and all(c["producto"] for c in r.json())
+        conteos[limit] = len(sentencias)
+        print(f"  limit={limit:<4} filas={len(r.json()):<4} consultas={conteos[limit]}")
+
+    # Recorrer todo el historial por cursor: siempre las mismas consultas por página
+    paginas, cursor = 0, None
+    while True:
+        sentencias.clear()
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        r = client.get(f"/compras/historial/{usuario_id}", params=params)
+        r.raise_for_status()
+        paginas += 1
+        if len(sentencias) != conteos[100]:
+            print(f"❌ la página {paginas} ejecutó {len(sentencias)} consultas")
+            sys.exit(1)
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    print(f"  {args.compras} compras en {paginas} páginas")
+
+    if len(set(conteos.values())) != 1:
+        print("❌ el número de consultas crece con las filas devueltas (N+1)")
+        sys.exit(1)
+    print(f"✅ {conteos[1]} consulta(s) por request, sin importar el tamaño de la página")
+
+
+if __name__ == "__main__":
+    main()
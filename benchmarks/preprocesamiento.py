@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesamiento de fotos para la validación QR.
+
+Compara la ruta anterior (decodificar la foto completa, `np.array` a resolución
+completa y luego reducir) con `services.preprocessing.cargar_para_modelo`
+(`draft()` + reducción directa al tamaño del modelo). Cada variante corre en
+un proceso aparte para medir su pico de memoria residente (RSS).
+
+Uso:
+    python benchmarks/preprocesamiento.py --ancho 4032 --alto 3024 --repeticiones 20
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.preprocessing import cargar_para_modelo  # noqa: E402
+
+FORMA = (224, 224)
+
+
+def ruta_anterior(fp) -> np.ndarray:
+    image = Image.open(fp)
+    np.array(image)  # copia a resolución completa, como hacía /qr/validate
+    image = image.convert("RGB").resize(FORMA)
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def ruta_nueva(fp) -> np.ndarray:
+    return cargar_para_modelo(fp, FORMA)
+
+
+def generar_jpeg(ancho: int, alto: int) -> bytes:
+    # Ruido suave para que el JPEG no sea trivialmente compresible
+    rng = np.random.default_rng(0)
+    pequena = rng.integers(0, 256, (alto // 16, ancho // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(pequena).resize((ancho, alto), Image.BILINEAR)
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _medir(nombre, datos, repeticiones, cola):
+    funcion = {"anterior": ruta_anterior, "nueva": ruta_nueva}[nombre]
+    funcion(io.BytesIO(datos))  # calentamiento
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(io.BytesIO(datos))
+    transcurrido = time.perf_counter() - inicio
+    rss_final = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cola.put((transcurrido / repeticiones, rss_final, rss_final - rss_inicial))
+
+
+def medir(nombre, datos, repeticiones):
+    cola = multiprocessing.Queue()
+    proceso = multiprocessing.Process(target=_medir, args=(nombre, datos, repeticiones, cola))
+    proceso.start()
+    resultado = cola.get()
+    proceso.join()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ancho", type=int, default=4032)
+    parser.add_argument("--alto", type=int, default=3024)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    datos = generar_jpeg(args.ancho, args.alto)
+    print(f"JPEG {args.ancho}x{args.alto} ({len(datos) / 1024:.0f} KB), {args.repeticiones} repeticiones")
+    resultados = {}
+    for nombre in ("anterior", "nueva"):
+        por_imagen, rss_pico, _ = medir(nombre, datos, args.repeticiones)
+        resultados[nombre] = por_imagen
+        # ru_maxrss está en KB en Linux
+        print(f"  {nombre:<9} {por_imagen * 1000:8.1f} ms/imagen   RSS pico {rss_pico / 1024:7.1f} MB")
+    print(f"  aceleración: x{resultados['anterior'] / resultados['nueva']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de compras concurrentes sobre un único producto con stock
+limitado (un "drop"): verifica que no haya sobreventa y mide el throughput.
+
+Lanza `--compradores` compras simultáneas de usuarios distintos contra
+POST /compras/ (en proceso, sin servidor HTTP) y al final comprueba en la
+base de datos que:
+  - se vendieron exactamente min(compradores, stock) unidades,
+  - el stock restante es stock - vendidas (nunca negativo),
+  - hay una fila en `compras` por cada venta.
+Si algo no cuadra termina con código 1.
+
+Por defecto usa una base SQLite temporal; con --database-url se puede correr
+contra Postgres (se crean tablas y datos de prueba en esa base).
+
+Uso:
+    python benchmarks/stock_concurrente.py --compradores 300 --stock 100
+    python benchmarks/stock_concurrente.py --cola   # con STOCK_QUEUE_ENABLED=1
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def comprar(client, usuario_id: int, producto_id: int) -> int:
+    r = await client.post("/compras/", json={"usuario_id": usuario_id, "producto_id": producto_id})
+    return r.status_code
+
+
+async def correr(app, usuarios, producto_id):
+    import httpx
+    from database import async_engine
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            inicio = time.perf_counter()
+            estados = await asyncio.gather(*(comprar(client, u, producto_id) for u in usuarios))
+            return estados, time.perf_counter() - inicio
+    finally:
+        # Cerrar las conexiones del pool (aiosqlite usa un hilo por conexión)
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compradores", type=int, default=300)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--cola", action="store_true", help="Activar la cola de reservas por producto")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    # database y services.stock leen su configuración al importarse
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stock.db')}"
+    os.environ["STOCK_QUEUE_ENABLED"] = "1" if args.cola else "0"
+    os.environ.setdefault("STOCK_QUEUE_MAX_WAITERS", str(args.compradores))
+    sys.path.insert(0, RAIZ)
+
+    import main as app_main
+    from database import SessionLocal
+    from models import Compra, Producto, Usuario
+
+    sufijo = uuid.uuid4().hex[:8]
+    with SessionLocal() as db:
+        producto = Producto(nombre=f"drop {sufijo}", precio=10, categoria="drop", imagen="x.png", stock=args.stock)
+        usuarios = [
+            Usuario(nombre=f"comprador {sufijo} {i}", email=f"{sufijo}.{i}@example.com", password_hash="", cleanpoints=1000)
+            for i in range(args.compradores)
+        ]
+        db.add(producto)
+        db.add_all(usuarios)
+        db.commit()
+        producto_id = producto.id
+        usuario_ids = [u.id for u in usuarios]
+
+    estados, transcurrido = asyncio.run(correr(app_main.app, usuario_ids, producto_id))
+    conteo = Counter(estados)
+
+    with SessionLocal() as db:
+        stock_final = db.get(Producto, producto_id).stock
+        filas = db.query(Compra).filter(Compra.producto_id == producto_id).count()
+
+    vendidas = conteo.get(200, 0)
+    esperadas = min(args.compradores, args.stock)
+    print(f"{args.compradores} compradores, stock {args.stock}, cola {'sí' if args.cola else 'no'}")
+    print(f"  respuestas: {dict(sorted(conteo.items()))}")
+    print(f"  vendidas {vendidas}, filas en compras {filas}, stock final {stock_final}")
+    print(f"  {transcurrido:.2f} s: {vendidas / transcurrido:.1f} compras/s, {len(estados) / transcurrido:.1f} requests/s")
+
+    errores = []
+    if vendidas != esperadas:
+        errores.append(f"se esperaban {esperadas} ventas")
+    if filas != vendidas:
+        errores.append("las filas de compras no coinciden con las ventas")
+    if stock_final != args.stock - vendidas or stock_final < 0:
+        errores.append("el stock final no coincide (sobreventa)")
+    if set(conteo) - {200, 409}:
+        errores.append("hubo respuestas distintas de 200/409")
+    if errores:
+        print("❌ " + "; ".join(errores))
+        sys.exit(1)
+    print("✅ sin sobreventa")
+
+
+if __name__ == "__main__":
+    main()
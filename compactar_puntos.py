@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Script para compactar el libro de movimientos de CleanPoints.
+
+Pliega los movimientos más antiguos que `--dias` días en filas snapshot (una
+con los créditos y otra con los débitos de cada usuario), de modo que la tabla
+`movimientos_puntos` no crece sin límite. Antes de compactar registra como
+snapshot el saldo de los usuarios que todavía no tienen movimientos.
+
+Pensado para ejecutarse periódicamente (cron, tarea programada, etc.).
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+import models  # noqa: F401  (registra los modelos en Base.metadata)
+from database import engine, Base, SessionLocal, IS_SQLITE
+from services.points import compactar_movimientos, sembrar_saldos_iniciales
+
+
+def compactar(dias: int):
+    Base.metadata.create_all(bind=engine)
+    antes_de = datetime.utcnow() - timedelta(days=dias)
+    db = SessionLocal()
+    try:
+        if not IS_SQLITE:
+            # Una sola foto de movimientos_puntos para resumir y borrar
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        sembrados = sembrar_saldos_iniciales(db)
+        eliminados = compactar_movimientos(db, antes_de)
+        db.commit()
+    finally:
+        db.close()
+    print(f"✅ Saldos iniciales registrados: {sembrados}")
+    print(f"✅ Movimientos anteriores a {antes_de:%Y-%m-%d %H:%M} compactados: {eliminados}")
+
+
+def dias_validos(valor: str) -> int:
+    dias = int(valor)
+    if dias < 1:
+        raise argparse.ArgumentTypeError("debe ser al menos 1")
+    return dias
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compactar el libro de movimientos de CleanPoints")
+    parser.add_argument("--dias", type=dias_validos, default=90, help="antigüedad mínima de los movimientos a compactar")
+    args = parser.parse_args()
+    compactar(args.dias)
@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
 from dotenv import load_dotenv
 
@@ -16,17 +20,140 @@ raw_db = os.getenv("DATABASE_URL", "sqlite:///./cursos.db")
 # Limpiar comillas y espacios residuales si el .env contiene: DATABASE_URL = "..."
 DATABASE_URL = raw_db.strip().strip('"').strip("'")
 
+# Drivers usados para cada dialecto: los síncronos los usan los scripts
+# (setup_db.py, migrate_db.py, create_all) y los asíncronos los routers.
+SYNC_DRIVERS = {"sqlite": "pysqlite", "postgresql": "psycopg2"}
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _with_driver(url: str, drivers: dict) -> str:
+    """Devuelve `url` usando el driver indicado en `drivers` para su dialecto.
+
+    Si el dialecto no está en `drivers` (MySQL, etc.) la URL se deja igual.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in drivers:
+        return url
+    return parsed.set(drivername=f"{backend}+{drivers[backend]}").render_as_string(hide_password=False)
+
+
+# DATABASE_URL puede indicar el driver síncrono (sqlite://, postgresql://) o el
+# asíncrono (sqlite+aiosqlite://, postgresql+asyncpg://); derivamos el otro.
+SYNC_DATABASE_URL = _with_driver(DATABASE_URL, SYNC_DRIVERS)
+ASYNC_DATABASE_URL = _with_driver(DATABASE_URL, ASYNC_DRIVERS)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Parámetros del pool de conexiones del engine asíncrono (ajustables por entorno):
+#  - DB_POOL_SIZE: conexiones que se mantienen abiertas
+#  - DB_MAX_OVERFLOW: conexiones extra permitidas en picos
+#  - DB_POOL_RECYCLE: segundos tras los cuales se recicla una conexión
+#  - DB_STATEMENT_TIMEOUT_MS: límite por sentencia en Postgres (0 = sin límite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+pool_settings = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_recycle": DB_POOL_RECYCLE,
+}
+
 # Crear engine con parámetros adecuados según el driver
-if DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     # SQLite necesita check_same_thread cuando se usa con SQLAlchemy en entornos síncronos
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(SYNC_DATABASE_URL, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_settings)
 else:
     # Para bases de datos remotas (Postgres, MySQL, etc.) habilitamos pool_pre_ping
     # para reconectar conexiones estaleadas automáticamente.
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    engine = create_engine(SYNC_DATABASE_URL, pool_pre_ping=True)
+    async_connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS and ASYNC_DATABASE_URL.startswith("postgresql"):
+        async_connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, pool_pre_ping=True, connect_args=async_connect_args, **pool_settings
+    )
 
 # Crear sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sesión asíncrona usada por los routers: un worker puede mantener miles de
+# esperas a la base de datos sin ocupar un hilo del threadpool por request.
+# expire_on_commit=False evita recargas implícitas (no permitidas en async)
+# al serializar objetos después de un commit.
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Base para los modelos (compartida con models.py)
 Base = declarative_base()
+
+
+class CheckoutCounter:
+    """Conexiones tomadas del pool durante un request."""
+
+    def __init__(self):
+        self.value = 0
+
+
+_checkout_counter: ContextVar[Optional[CheckoutCounter]] = ContextVar("db_checkout_counter", default=None)
+
+
+def start_checkout_counter() -> CheckoutCounter:
+    """Empieza a contar las conexiones que el request actual toma del pool."""
+    counter = CheckoutCounter()
+    _checkout_counter.set(counter)
+    return counter
+
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    counter = _checkout_counter.get()
+    if counter is not None:
+        counter.value += 1
+
+
+# Cachés que guardan datos de usuarios (ver services/auth_cache.py) se
+# suscriben con `al_modificar_usuarios`; los writers marcan las filas tocadas
+# con `marcar_usuario_modificado` y el aviso llega solo si la transacción se
+# confirma, así una caché nunca se recarga con datos aún no confirmados.
+# Los oyentes reciben {usuario_id: saldo de CleanPoints}, con el saldo nuevo
+# si el writer lo conoce (p. ej. por RETURNING) o None si no.
+_oyentes_usuarios: List[Callable[[Dict[int, Optional[int]]], None]] = []
+
+
+def al_modificar_usuarios(fn: Callable[[Dict[int, Optional[int]]], None]):
+    _oyentes_usuarios.append(fn)
+    return fn
+
+
+def marcar_usuario_modificado(session, usuario_id: int, cleanpoints: Optional[int] = None):
+    modificados = session.info.setdefault("usuarios_modificados", {})
+    if cleanpoints is not None or usuario_id not in modificados:
+        modificados[usuario_id] = cleanpoints
+
+
+@event.listens_for(Session, "after_commit")
+def _avisar_usuarios_modificados(session):
+    usuarios = session.info.pop("usuarios_modificados", None)
+    if usuarios:
+        for fn in _oyentes_usuarios:
+            fn(usuarios)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_usuarios_modificados(session):
+    session.info.pop("usuarios_modificados", None)
+
+
+async def get_db():
+    """Sesión única por request, compartida por los routers y por la autenticación.
+
+    FastAPI cachea las dependencias dentro de un mismo request, así que
+    `get_current_user` y el endpoint reciben la misma sesión (y la misma
+    conexión del pool).
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
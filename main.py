@@ -1,10 +1,42 @@
-from fastapi import FastAPI
-from routers import cursos, usuarios, recompensas, marketplace, compras, auth, qr
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import cursos, usuarios, recompensas, marketplace, compras, auth, qr, imagenes, stats
 from models import Base
-from database import engine
+from database import engine, async_engine, start_checkout_counter
+from services import metrics
+from services.inference import scheduler
+from services.model_registry import registry
+from services.image_cache import image_cache
+from services.password_hashing import hasher
+from services.qr_audit import qr_auditoria
+from services.leaderboard import leaderboard
+from services.course_search import asegurar_indice_busqueda
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="Backend de CleanPoints", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cargar y calentar el clasificador una sola vez antes de atender requests
+    await registry.cargar(tamanos_lote=(1, scheduler.max_batch_size))
+    scheduler.start()
+    await image_cache.cargar_persistidas()
+    qr_auditoria.start()
+    # Ranking de CleanPoints en memoria (se mantiene con cada commit)
+    await leaderboard.reconstruir()
+    leaderboard.start()
+    # Reanudar los trabajos de validación asíncrona que quedaron sin terminar
+    await qr.recuperar_trabajos()
+    yield
+    await qr.trabajos.stop()
+    # Escribir la auditoría QR que quede en memoria antes de cerrar el pool
+    await qr_auditoria.stop()
+    await leaderboard.stop()
+    await scheduler.stop()
+    hasher.cerrar()
+    # Cerrar las conexiones del pool asíncrono al apagar el servidor
+    await async_engine.dispose()
+
+app = FastAPI(title="Backend de CleanPoints", version="1.0.0", lifespan=lifespan)
 
 # Incluir todos los routers
 app.include_router(auth.router)
@@ -14,6 +46,28 @@ app.include_router(usuarios.router)
 app.include_router(recompensas.router)
 app.include_router(marketplace.router)
 app.include_router(compras.router)
+app.include_router(imagenes.router)
+app.include_router(stats.router)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def exportar_metricas():
+    # Métricas del proceso en formato de texto de Prometheus
+    return metrics.render_prometheus()
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    # Listo solo cuando el modelo de validación está cargado y calentado
+    if not registry.listo:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True, "model_version": registry.version}
+
+@app.middleware("http")
+async def contar_conexiones_db(request: Request, call_next):
+    # Exponer cuántas conexiones del pool usó el request (debería ser una)
+    counter = start_checkout_counter()
+    response = await call_next(request)
+    response.headers["X-DB-Checkouts"] = str(counter.value)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +75,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor de la página siguiente en los listados paginados
+    expose_headers=["X-Next-Cursor"],
 )
 
 Base.metadata.create_all(bind=engine)
+asegurar_indice_busqueda(engine)
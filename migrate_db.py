@@ -5,7 +5,10 @@ Ejecutar este script después de actualizar los modelos.
 """
 
 import os
+from sqlalchemy.engine import make_url
 from database import DATABASE_URL, engine, Base
+import models  # noqa: F401  (registra los modelos en Base.metadata)
+from services.course_search import asegurar_indice_busqueda
 
 """
 Script para migrar/asegurar la base de datos.
@@ -15,12 +18,26 @@ Si se usa otra DB (p. ej. Postgres), usa SQLAlchemy `Base.metadata.create_all` p
 crear las tablas que falten (no hace migraciones complejas).
 """
 
+def asegurar_indices():
+    """Crea los índices declarados en los modelos que falten.
+
+    `create_all` solo crea índices junto con tablas nuevas; los índices
+    agregados a tablas existentes (p. ej. ix_compras_usuario_fecha_id) se
+    crean aquí.
+    """
+    for tabla in Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=engine, checkfirst=True)
+    # Índice de búsqueda de cursos (FTS5 en SQLite, GIN en Postgres)
+    asegurar_indice_busqueda(engine)
+
+
 def migrate_database():
     if DATABASE_URL.startswith("sqlite"):
         # Si es sqlite, reusar la implementación antigua (más específica)
         try:
             import sqlite3
-            db_path = DATABASE_URL.replace("sqlite:///", "")
+            db_path = make_url(DATABASE_URL).database
             if not os.path.exists(db_path):
                 print("Base de datos SQLite no encontrada. Creando nueva con modelos...")
                 Base.metadata.create_all(bind=engine)
@@ -45,7 +62,21 @@ def migrate_database():
                     print(f"❌ Error al añadir columna: {e}")
             else:
                 print("✅ No se requieren cambios adicionales en usuarios.")
+            # Lease de los trabajos de validación asíncrona (si la tabla ya existe)
+            cursor.execute("PRAGMA table_info('trabajos_validacion')")
+            cols = [row[1] for row in cursor.fetchall()]
+            for columna, tipo in (("worker_id", "VARCHAR(64)"), ("fecha_reclamo", "DATETIME")):
+                if cols and columna not in cols:
+                    print(f"➡️  Añadiendo columna '{columna}' a la tabla 'trabajos_validacion'...")
+                    try:
+                        cursor.execute(f"ALTER TABLE trabajos_validacion ADD COLUMN {columna} {tipo}")
+                        conn.commit()
+                    except Exception as e:
+                        print(f"❌ Error al añadir columna: {e}")
             conn.close()
+            # Crear las tablas nuevas que falten (p. ej. movimientos_puntos)
+            Base.metadata.create_all(bind=engine)
+            asegurar_indices()
             return
         except Exception as e:
             print(f"Error durante migración SQLite: {e}")
@@ -55,7 +86,8 @@ def migrate_database():
     print("Usando SQLAlchemy para crear/asegurar tablas en la base de datos remota...")
     try:
         Base.metadata.create_all(bind=engine)
-        print("✅ Tablas creadas/aseguradas en la base de datos remota.")
+        asegurar_indices()
+        print("✅ Tablas e índices creados/asegurados en la base de datos remota.")
     except Exception as e:
         print(f"❌ Error creando tablas en la base de datos remota: {e}")
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, Date, DateTime, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -26,13 +26,18 @@ class Usuario(Base):
     avatar = Column(String, nullable=True)
     recompensas = relationship("Recompensa", back_populates="usuario")
 
+    __table_args__ = (
+        # Ranking por CleanPoints (reconstrucción de services/leaderboard.py)
+        Index("ix_usuarios_cleanpoints", "cleanpoints"),
+    )
+
 class Recompensa(Base):
     __tablename__ = "recompensas"
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String, nullable=False)
     descripcion = Column(String)
     puntos_requeridos = Column(Integer, nullable=False)
-    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True, index=True)
 
     usuario = relationship("Usuario", back_populates="recompensas")
 
@@ -48,6 +53,14 @@ class Producto(Base):
     disponible = Column(Integer, default=1)  # 1 = True, 0 = False
     puntos_requeridos = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # Filtros y órdenes del catálogo (GET /marketplace/productos/): el
+        # id al final permite paginar por cursor sobre el mismo índice
+        Index("ix_productos_categoria_disponible_precio", "categoria", "disponible", "precio", "id"),
+        Index("ix_productos_disponible_precio", "disponible", "precio", "id"),
+        Index("ix_productos_puntos_requeridos", "puntos_requeridos"),
+    )
+
 class Compra(Base):
     __tablename__ = "compras"
     id = Column(Integer, primary_key=True, index=True)
@@ -57,5 +70,104 @@ class Compra(Base):
     descuento_aplicado = Column(Integer, nullable=False)
     fecha = Column(DateTime, default=datetime.utcnow)
 
-    usuario = relationship("Usuario")
-    producto = relationship("Producto")
+    # En async no hay carga perezosa: cada consulta debe pedir la relación
+    # (joinedload/selectinload). raise_on_sql convierte un N+1 olvidado en
+    # un error visible en lugar de una consulta por fila.
+    usuario = relationship("Usuario", lazy="raise_on_sql")
+    producto = relationship("Producto", lazy="raise_on_sql")
+
+    __table_args__ = (
+        # Historial de compras por usuario paginado por (fecha, id). Se
+        # recorre en orden descendente: un B-tree se lee igual en ambos
+        # sentidos, así que no hace falta declararlo DESC.
+        Index("ix_compras_usuario_fecha_id", "usuario_id", "fecha", "id"),
+    )
+
+class MovimientoPuntos(Base):
+    """Libro de movimientos de CleanPoints (solo inserciones).
+
+    El saldo materializado sigue siendo `Usuario.cleanpoints`, que se actualiza
+    en la misma transacción que cada movimiento. `snapshot` marca las filas que
+    resumen movimientos antiguos ya compactados.
+    """
+    __tablename__ = "movimientos_puntos"
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    delta = Column(Integer, nullable=False)
+    motivo = Column(String, nullable=False)
+    origen_id = Column(String, nullable=True)
+    fecha = Column(DateTime, default=datetime.utcnow, nullable=False)
+    snapshot = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        Index("ix_movimientos_puntos_usuario_fecha", "usuario_id", "fecha"),
+        Index("ix_movimientos_puntos_fecha", "fecha"),
+    )
+
+class HuellaImagen(Base):
+    """Hash perceptual (dHash de 64 bits, en hexadecimal) de una foto ya validada."""
+    __tablename__ = "huellas_imagenes"
+    id = Column(Integer, primary_key=True, index=True)
+    huella = Column(String(16), nullable=False, index=True)
+    valido = Column(Boolean, nullable=False)
+    fecha = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class TrabajoValidacion(Base):
+    """Validación QR en modo asíncrono (202 Accepted + GET /qr/jobs/{id}).
+
+    La foto se guarda en `imagen` hasta que un worker procesa el trabajo; al
+    terminar se borra y quedan solo el resultado y el mensaje. Mientras se
+    procesa, `worker_id` y `fecha_reclamo` indican qué proceso lo tiene y
+    desde cuándo (lease, ver services/jobs.py).
+    """
+    __tablename__ = "trabajos_validacion"
+    id = Column(String(32), primary_key=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    qr_code = Column(String, nullable=False)
+    imagen = Column(LargeBinary, nullable=True)
+    estado = Column(String(16), nullable=False, default="pendiente", index=True)
+    valido = Column(Boolean, nullable=True)
+    cleanpoints_earned = Column(Integer, nullable=False, default=0)
+    mensaje = Column(String, nullable=True)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow, nullable=False)
+    fecha_fin = Column(DateTime, nullable=True)
+    worker_id = Column(String(64), nullable=True)
+    fecha_reclamo = Column(DateTime, nullable=True)
+
+class QRTransaction(Base):
+    """Auditoría de cada validación QR (válida o no).
+
+    Se escribe en segundo plano por lotes (services/qr_audit.py): `created_at`
+    es el momento de la validación, no el de la inserción.
+    """
+    __tablename__ = "qr_transactions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    container_id = Column(String, nullable=False)
+    image_url = Column(String, nullable=True)
+    points_awarded = Column(Integer, nullable=False, default=0)
+    validated = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_qr_transactions_user_created", "user_id", "created_at"),
+    )
+
+class EstadisticaUsuarioDia(Base):
+    """Validaciones exitosas y CleanPoints ganados por usuario y día (UTC).
+
+    Se actualiza con un upsert en la misma transacción que otorga los puntos
+    (services/stats.py) y se puede reconstruir desde `qr_transactions`.
+    """
+    __tablename__ = "estadisticas_usuario_dia"
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
+    dia = Column(Date, primary_key=True)
+    validaciones = Column(Integer, nullable=False, default=0)
+    cleanpoints = Column(Integer, nullable=False, default=0)
+
+class EstadisticaGlobalHora(Base):
+    """Validaciones exitosas y CleanPoints otorgados en toda la plataforma por hora (UTC)."""
+    __tablename__ = "estadisticas_globales_hora"
+    hora = Column(DateTime, primary_key=True)
+    validaciones = Column(Integer, nullable=False, default=0)
+    cleanpoints = Column(Integer, nullable=False, default=0)
@@ -1,17 +0,0 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
-from database import Base
-
-class QRTransaction(Base):
-    __tablename__ = "qr_transactions"
-
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    container_id = Column(String)
-    image_url = Column(String)
-    points_awarded = Column(Integer)
-    validated = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-
-    user = relationship("User", back_populates="qr_transactions")
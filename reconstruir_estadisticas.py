@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir las estadísticas de reciclaje (rollups por usuario y
+día y globales por hora) desde el registro de validaciones `qr_transactions`.
+
+Sirve para poblar los rollups la primera vez o para corregirlos. Lee el
+registro por lotes (`--lote` filas por consulta) y reemplaza los rollups en
+una sola transacción: todos, o desde el día `--desde` (YYYY-MM-DD).
+
+El registro se escribe en segundo plano con unos cientos de milisegundos de
+retraso (ver services/qr_audit.py): con el servidor atendiendo validaciones,
+las de los últimos instantes pueden faltar en el resultado. Conviene
+ejecutarlo con poco tráfico o con el servidor detenido.
+"""
+
+import argparse
+from datetime import date
+
+import models  # noqa: F401  (registra los modelos en Base.metadata)
+from database import engine, Base, SessionLocal
+from services.stats import reconstruir_estadisticas, LOTE_RECONSTRUCCION
+
+
+def reconstruir(desde, lote: int):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        leidas, filas_dia, filas_hora = reconstruir_estadisticas(db, desde, lote)
+        db.commit()
+    finally:
+        db.close()
+    print(f"✅ Validaciones leídas: {leidas}")
+    print(f"✅ Filas por usuario y día: {filas_dia}; filas globales por hora: {filas_hora}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruir las estadísticas de reciclaje desde qr_transactions")
+    parser.add_argument("--desde", type=date.fromisoformat, default=None, help="primer día a reconstruir (YYYY-MM-DD); por defecto, todo")
+    parser.add_argument("--lote", type=int, default=LOTE_RECONSTRUCCION, help="filas de qr_transactions por consulta")
+    args = parser.parse_args()
+    reconstruir(args.desde, args.lote)
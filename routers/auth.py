@@ -1,14 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import jwt
-import bcrypt
-from typing import Optional
+from typing import Optional, Tuple
 
 from models import Usuario
 from schemas import LoginRequest, RegisterRequest, AuthResponse, UsuarioOut
-from database import SessionLocal
+from database import get_db, marcar_usuario_modificado
+from services.auth_cache import token_cache, UsuarioSnapshot
+from services.password_hashing import hasher, HasherSaturado, BCRYPT_ROUNDS, hashear, verificar
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
 
@@ -19,13 +21,6 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 security = HTTPBearer()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -36,44 +31,86 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Versiones síncronas para scripts; los endpoints usan el pool acotado
+# `hasher` (services/password_hashing.py)
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return verificar(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    return hashear(password, BCRYPT_ROUNDS)
+
+def _hasher_saturado() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Demasiados inicios de sesión simultáneos, inténtalo de nuevo en unos segundos",
+        headers={"Retry-After": "1"},
+    )
+
+def _token_invalido(detail: str = "Token inválido") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+def _verificar_token(token: str) -> Tuple[int, Optional[float]]:
+    """Verifica la firma y la expiración del JWT; devuelve (user_id, exp)."""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("sub")
         if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token inválido",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-    except jwt.PyJWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    user = db.query(Usuario).filter(Usuario.id == user_id).first()
+            raise _token_invalido()
+        # asyncpg no convierte tipos implícitamente: el "sub" llega como str
+        return int(user_id), payload.get("exp")
+    except (jwt.PyJWTError, ValueError):
+        raise _token_invalido()
+
+async def get_current_user_snapshot(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db),
+) -> UsuarioSnapshot:
+    """
+    Usuario autenticado como snapshot inmutable. Si el token ya se verificó
+    hace poco, sale de la caché sin decodificar el JWT ni tocar la base de
+    datos (la sesión ni siquiera toma una conexión del pool).
+    """
+    token = credentials.credentials
+    snapshot = token_cache.buscar(token)
+    if snapshot is not None:
+        return snapshot
+
+    user_id, exp = _verificar_token(token)
+    marca = token_cache.marca()
+    user = await db.get(Usuario, user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Usuario no encontrado",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _token_invalido("Usuario no encontrado")
+    snapshot = UsuarioSnapshot.desde_usuario(user)
+    token_cache.guardar(token, snapshot, exp, marca)
+    return snapshot
+
+async def get_current_user_id(snapshot: UsuarioSnapshot = Depends(get_current_user_snapshot)) -> int:
+    """Para endpoints que solo necesitan saber quién llama."""
+    return snapshot.id
+
+async def get_current_user(
+    snapshot: UsuarioSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_db),
+) -> Usuario:
+    """
+    Fila ORM del usuario autenticado, para endpoints que la modifican o la
+    devuelven completa. Si el snapshot vino de la base de datos en este mismo
+    request, db.get la toma del identity map sin repetir la consulta.
+    """
+    user = await db.get(Usuario, snapshot.id)
+    if user is None:
+        token_cache.invalidar_usuarios({snapshot.id})
+        raise _token_invalido("Usuario no encontrado")
     return user
 
 @router.post("/register", response_model=AuthResponse)
-def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
+async def register(user_data: RegisterRequest, db: AsyncSession = Depends(get_db)):
     # Verificar si el email ya existe
-    existing_user = db.query(Usuario).filter(Usuario.email == user_data.email).first()
+    existing_user = await db.scalar(select(Usuario).filter(Usuario.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,15 +118,18 @@ def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
         )
     
     # Verificar si el nombre ya existe
-    existing_name = db.query(Usuario).filter(Usuario.nombre == user_data.nombre).first()
+    existing_name = await db.scalar(select(Usuario).filter(Usuario.nombre == user_data.nombre))
     if existing_name:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="El nombre de usuario ya está en uso"
         )
     
-    # Crear nuevo usuario
-    hashed_password = get_password_hash(user_data.password)
+    # Crear nuevo usuario (bcrypt es CPU intensivo: pool propio y acotado)
+    try:
+        hashed_password = await hasher.hash(user_data.password)
+    except HasherSaturado:
+        raise _hasher_saturado()
     db_user = Usuario(
         nombre=user_data.nombre,
         email=user_data.email,
@@ -99,8 +139,10 @@ def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # El id se conoce tras el flush: el usuario entra al ranking al confirmar
+    await db.flush()
+    marcar_usuario_modificado(db, db_user.id, 0)
+    await db.commit()
     
     # Crear token de acceso
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -125,9 +167,9 @@ def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
     )
 
 @router.post("/login", response_model=AuthResponse)
-def login(credentials: LoginRequest, db: Session = Depends(get_db)):
+async def login(credentials: LoginRequest, db: AsyncSession = Depends(get_db)):
     # Buscar usuario por email
-    user = db.query(Usuario).filter(Usuario.email == credentials.email).first()
+    user = await db.scalar(select(Usuario).filter(Usuario.email == credentials.email))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -135,12 +177,25 @@ def login(credentials: LoginRequest, db: Session = Depends(get_db)):
         )
     
     # Verificar contraseña
-    if not verify_password(credentials.password, user.password_hash):
+    try:
+        password_ok = await hasher.verify(credentials.password, user.password_hash)
+    except HasherSaturado:
+        raise _hasher_saturado()
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos"
         )
     
+    # Recalcular el hash si se guardó con otro BCRYPT_ROUNDS. Es opcional: si
+    # el pool está lleno se deja para el próximo login.
+    if hasher.necesita_rehash(user.password_hash):
+        try:
+            user.password_hash = await hasher.hash(credentials.password)
+            await db.commit()
+        except HasherSaturado:
+            pass
+    
     # Crear token de acceso
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -164,23 +219,23 @@ def login(credentials: LoginRequest, db: Session = Depends(get_db)):
     )
 
 @router.post("/refresh")
-def refresh_token(current_user: Usuario = Depends(get_current_user)):
+async def refresh_token(current_user_id: int = Depends(get_current_user_id)):
     # Crear nuevo token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": str(current_user.id)}, expires_delta=access_token_expires
+        data={"sub": str(current_user_id)}, expires_delta=access_token_expires
     )
     
     return {"token": access_token}
 
 @router.post("/logout")
-def logout():
+async def logout():
     # En JWT, el logout se maneja del lado del cliente eliminando el token
     # Aquí podrías implementar una lista negra de tokens si es necesario
     return {"message": "Sesión cerrada exitosamente"}
 
 @router.get("/me", response_model=UsuarioOut)
-def get_current_user_info(current_user: Usuario = Depends(get_current_user)):
+async def get_current_user_info(current_user: UsuarioSnapshot = Depends(get_current_user_snapshot)):
     return UsuarioOut(
         id=current_user.id,
         nombre=current_user.nombre,
@@ -1,64 +1,196 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlalchemy.orm import Session
-from models import Compra, Usuario, Producto
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Response
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import Dict, Optional
+from models import Compra, Producto
 from schemas import CompraOut
-from database import SessionLocal
+from database import get_db
+from services.carrito import agrupar_items, cargar_productos, CarritoDemasiadoGrande, ProductosNoEncontrados
+from services.pagination import paginar, PAGINATION_MAX_LIMIT
+from services.points import aplicar_puntos, SaldoInsuficiente, UsuarioNoEncontrado, MOTIVO_COMPRA
+from services.response_cache import response_cache
+from services.stock import reservar_stock, reservas, ColaReservasLlena, SinStock, ProductoNoEncontrado
 
 router = APIRouter(prefix="/compras", tags=["Compras"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def calcular_descuento(cleanpoints: int, puntos_por_descuento: int = 10, max_descuento: int = 50) -> int:
     return min(cleanpoints // puntos_por_descuento, max_descuento)
 
-from schemas import CompraOut, CompraResponse
+from schemas import CompraOut, CompraResponse, CarritoCompra, CarritoResponse
 
 
 @router.post("/", response_model=CompraResponse)
-def comprar_producto(
+async def comprar_producto(
     usuario_id: int = Body(..., embed=True),
     producto_id: int = Body(..., embed=True),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
-    producto = db.query(Producto).filter(Producto.id == producto_id).first()
-    if not usuario or not producto:
+    # Con STOCK_QUEUE_ENABLED=1 los compradores de un mismo producto pasan de
+    # a uno (ver services/stock.py); el turno cubre la transacción completa
+    try:
+        async with reservas.turno(producto_id):
+            return await _comprar(db, usuario_id, producto_id)
+    except ColaReservasLlena:
+        raise HTTPException(
+            status_code=503,
+            detail="Hay demasiados compradores para este producto, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": "1"},
+        )
+
+async def _comprar(db: AsyncSession, usuario_id: int, producto_id: int) -> dict:
+    producto = await db.get(Producto, producto_id)
+    if not producto:
         raise HTTPException(status_code=404, detail="Usuario o producto no encontrado")
     # Para comportamiento esperado por el cliente: descontar el precio del producto
     # (sin descuentos automáticos). Si se desea soporte de descuentos, agregar
     # lógica controlada explícitamente.
     precio_final = float(producto.precio)
 
-    # Verificar que el usuario tenga saldo suficiente
-    puntos_a_descontar = int(round(precio_final))
-    current_points = usuario.cleanpoints or 0
-    if current_points < puntos_a_descontar:
-        raise HTTPException(status_code=400, detail="No tienes suficientes CleanPoints para esta compra")
+    # Reservar stock, crear la compra y descontar los CleanPoints en una sola
+    # transacción. Cada paso es un UPDATE/INSERT condicional: si alguno falla
+    # se deshace todo (y se libera el lock de la fila del producto).
+    try:
+        await reservar_stock(db, producto_id)
+    except ProductoNoEncontrado:
+        raise HTTPException(status_code=404, detail="Usuario o producto no encontrado")
+    except SinStock:
+        raise HTTPException(status_code=409, detail="Producto agotado")
 
-    # Crear la compra y descontar los CleanPoints del usuario en una sola transacción
+    # La compra se inserta antes de los puntos para registrar su id en el libro.
     compra = Compra(
         usuario_id=usuario_id,
         producto_id=producto_id,
         precio_pagado=round(precio_final, 2),
-        descuento_aplicado=0
+        descuento_aplicado=0,
+        # Asociar el producto ya cargado: en async no hay carga perezosa al serializar
+        producto=producto
     )
+    db.add(compra)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Usuario o producto no encontrado")
+
+    # Descontar los puntos del usuario (redondear a entero). El UPDATE
+    # condicional verifica el saldo suficiente en la misma sentencia.
+    puntos_a_descontar = int(round(precio_final))
+    try:
+        new_balance = await aplicar_puntos(db, usuario_id, -puntos_a_descontar, MOTIVO_COMPRA, compra.id)
+    except UsuarioNoEncontrado:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Usuario o producto no encontrado")
+    except SaldoInsuficiente:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="No tienes suficientes CleanPoints para esta compra")
 
-    # Descontar los puntos del usuario (redondear a entero)
-    usuario.cleanpoints = max(0, current_points - puntos_a_descontar)
+    await db.commit()
+    if producto.stock is not None:
+        # El listado del catálogo muestra el stock
+        response_cache.invalidar("productos")
 
-    db.add(compra)
-    db.add(usuario)
-    db.commit()
-    db.refresh(compra)
-    db.refresh(usuario)
+    return {"compra": compra, "new_balance": new_balance}
+
+@router.post("/carrito", response_model=CarritoResponse)
+async def comprar_carrito(carrito: CarritoCompra, db: AsyncSession = Depends(get_db)):
+    """
+    Compra todos los productos del carrito en una sola transacción: o se
+    compran todos o ninguno. Cada unidad queda registrada como una compra.
+    """
+    try:
+        cantidades = agrupar_items(carrito.items)
+    except CarritoDemasiadoGrande as e:
+        raise HTTPException(status_code=400, detail=f"El carrito admite como máximo {e.args[0]} unidades")
+    try:
+        # Turnos tomados en orden de producto_id (como los locks de las filas)
+        async with AsyncExitStack() as turnos:
+            for producto_id in cantidades:
+                await turnos.enter_async_context(reservas.turno(producto_id))
+            return await _comprar_carrito(db, carrito.usuario_id, cantidades)
+    except ColaReservasLlena:
+        raise HTTPException(
+            status_code=503,
+            detail="Hay demasiados compradores para este producto, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": "1"},
+        )
+
+async def _comprar_carrito(db: AsyncSession, usuario_id: int, cantidades: Dict[int, int]) -> dict:
+    # Una consulta para todos los productos, un UPDATE condicional de stock
+    # por producto, un INSERT con todas las compras y un único UPDATE del
+    # saldo (que valida el total contra los CleanPoints del usuario).
+    try:
+        productos = await cargar_productos(db, cantidades)
+    except ProductosNoEncontrados as e:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(map(str, e.args[0]))}")
 
-    return {"compra": compra, "new_balance": usuario.cleanpoints}
+    for producto_id, cantidad in cantidades.items():
+        try:
+            await reservar_stock(db, producto_id, cantidad)
+        except ProductoNoEncontrado:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail=f"Productos no encontrados: {producto_id}")
+        except SinStock:
+            nombre = productos[producto_id].nombre
+            await db.rollback()
+            raise HTTPException(status_code=409, detail=f"Stock insuficiente de {nombre}")
+
+    filas = [
+        {
+            "usuario_id": usuario_id,
+            "producto_id": producto_id,
+            "precio_pagado": round(float(productos[producto_id].precio), 2),
+            "descuento_aplicado": 0,
+        }
+        for producto_id, cantidad in cantidades.items()
+        for _ in range(cantidad)
+    ]
+    try:
+        # Un solo INSERT de varias filas (insertmanyvalues) con RETURNING
+        result = await db.scalars(insert(Compra).returning(Compra), filas)
+        compras = list(result)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    for compra in compras:
+        set_committed_value(compra, "producto", productos[compra.producto_id])
+
+    total_puntos = sum(int(round(float(productos[p].precio))) * cantidad for p, cantidad in cantidades.items())
+    try:
+        new_balance = await aplicar_puntos(
+            db, usuario_id, -total_puntos, MOTIVO_COMPRA, ",".join(str(compra.id) for compra in compras)
+        )
+    except UsuarioNoEncontrado:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    except SaldoInsuficiente:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="No tienes suficientes CleanPoints para este carrito")
+
+    await db.commit()
+    if any(producto.stock is not None for producto in productos.values()):
+        response_cache.invalidar("productos")
+
+    return {"compras": compras, "total_puntos": total_puntos, "new_balance": new_balance}
 
 @router.get("/historial/{usuario_id}", response_model=list[CompraOut])
-def historial_compras(usuario_id: int, db: Session = Depends(get_db)):
-    return db.query(Compra).filter(Compra.usuario_id == usuario_id).order_by(Compra.fecha.desc()).all()
\ No newline at end of file
+async def historial_compras(
+    usuario_id: int,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: AsyncSession = Depends(get_db),
+):
+    # Más recientes primero; el cursor es (fecha, id) y usa el índice
+    # ix_compras_usuario_fecha_id. El producto llega en el mismo SELECT
+    # (JOIN): una sola consulta por página sin importar cuántas compras haya.
+    query = (
+        select(Compra)
+        .options(joinedload(Compra.producto))
+        .filter(Compra.usuario_id == usuario_id)
+    )
+    return await paginar(db, query, [Compra.fecha, Compra.id], response, limit, cursor, skip, descendente=True)
\ No newline at end of file
@@ -1,22 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import TypeAdapter
 import os
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from typing import Any, Dict, Optional, Sequence
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 from models import Curso
-from schemas import CursoCreate, CursoOut
-from database import SessionLocal
+from schemas import CursoCreate, CursoOut, CursoResumen, CursoBusqueda
+from database import get_db
+from services.pagination import paginar, PAGINATION_MAX_LIMIT
+from services.response_cache import response_cache
+from services.course_search import buscar_cursos
 
 router = APIRouter(prefix="/cursos", tags=["Cursos"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+_lista_cursos = TypeAdapter(list[CursoResumen])
+_lista_proyectada = TypeAdapter(list[Dict[str, Any]])
+
+# Campos del listado por defecto y campos que se pueden pedir con `fields=`
+CAMPOS_RESUMEN = tuple(CursoResumen.model_fields)
+CAMPOS_CURSO = tuple(CursoOut.model_fields)
+
+def _campos_pedidos(fields: Optional[str]) -> Sequence[str]:
+    if not fields:
+        return CAMPOS_RESUMEN
+    campos = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    invalidos = [c for c in campos if c not in CAMPOS_CURSO]
+    if invalidos or not campos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no válidos: {', '.join(invalidos) or fields}. Disponibles: {', '.join(CAMPOS_CURSO)}",
+        )
+    return campos
 
 @router.post("/", response_model=CursoOut)
-def crear_curso(curso: CursoCreate, db: Session = Depends(get_db)):
-    if db.query(Curso).filter(Curso.titulo == curso.titulo).first():
+async def crear_curso(curso: CursoCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(Curso).filter(Curso.titulo == curso.titulo)):
         raise HTTPException(status_code=400, detail="Ya existe un curso con ese título")
     # Normalizar campo de imagen: preferir imagen_url, si no existe usar imagen
     payload = curso.dict()
@@ -25,26 +44,61 @@ def crear_curso(curso: CursoCreate, db: Session = Depends(get_db)):
         payload['imagen_url'] = raw_img
     db_curso = Curso(**{k: v for k, v in payload.items() if k in Curso.__table__.columns.keys()})
     db.add(db_curso)
-    db.commit()
-    db.refresh(db_curso)
+    await db.commit()
+    response_cache.invalidar("cursos")
     # Normalizar respuesta: asegurar que siempre haya imagen_url
     return _normalize_curso_output(db_curso)
 
-@router.get("/", response_model=list[CursoOut])
-def listar_cursos(skip: int = Query(0, ge=0), limit: int = Query(10, ge=1), db: Session = Depends(get_db)):
-    cursos = db.query(Curso).offset(skip).limit(limit).all()
-    return [_normalize_curso_output(c) for c in cursos]
+@router.get("/", response_model=list[CursoResumen])
+async def listar_cursos(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por comas, p. ej. id,titulo,contenido"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Listado de cursos. Por defecto devuelve el resumen (sin `contenido`);
+    `fields=` elige los campos exactos. Solo se seleccionan de la base de
+    datos las columnas pedidas.
+    """
+    campos = _campos_pedidos(fields)
+    columnas = [getattr(Curso, c) for c in campos if c in Curso.__table__.columns and c != "id"]
+    query = select(Curso).options(load_only(Curso.id, *columnas))
+    adapter = _lista_proyectada if fields else _lista_cursos
+
+    # JSON ya serializado con ETag; se invalida al crear/editar/eliminar cursos
+    async def generar(response: Response):
+        cursos = await paginar(db, query, [Curso.id], response, limit, cursor, skip)
+        return [_normalize_curso_output(c, campos) for c in cursos]
+    return await response_cache.responder("cursos", request, adapter, generar)
+
+# Declarada antes de /{curso_id} para que "search" no se interprete como id
+@router.get("/search", response_model=list[CursoBusqueda])
+async def buscar(
+    q: str = Query(..., min_length=1, max_length=200, description="Texto a buscar en título, descripción, tema y contenido"),
+    limit: int = Query(10, ge=1, le=PAGINATION_MAX_LIMIT),
+    skip: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Búsqueda de texto completo sobre cursos, ordenada por relevancia y con un
+    fragmento del texto donde aparecen los términos. Usa FTS5 en SQLite y un
+    índice GIN sobre tsvector en Postgres (ver services/course_search.py).
+    """
+    return await buscar_cursos(db, q, limit, skip)
 
 @router.get("/{curso_id}", response_model=CursoOut)
-def obtener_curso(curso_id: int, db: Session = Depends(get_db)):
-    curso = db.query(Curso).filter(Curso.id == curso_id).first()
+async def obtener_curso(curso_id: int, db: AsyncSession = Depends(get_db)):
+    curso = await db.scalar(select(Curso).filter(Curso.id == curso_id))
     if not curso:
         raise HTTPException(status_code=404, detail="Curso no encontrado")
     return _normalize_curso_output(curso)
 
 @router.put("/{curso_id}", response_model=CursoOut)
-def actualizar_curso(curso_id: int, curso: CursoCreate, db: Session = Depends(get_db)):
-    db_curso = db.query(Curso).filter(Curso.id == curso_id).first()
+async def actualizar_curso(curso_id: int, curso: CursoCreate, db: AsyncSession = Depends(get_db)):
+    db_curso = await db.scalar(select(Curso).filter(Curso.id == curso_id))
     if not db_curso:
         raise HTTPException(status_code=404, detail="Curso no encontrado")
     payload = curso.dict()
@@ -55,29 +109,38 @@ def actualizar_curso(curso_id: int, curso: CursoCreate, db: Session = Depends(ge
         # Only set attributes that exist on the model
         if key in Curso.__table__.columns.keys():
             setattr(db_curso, key, value)
-    db.commit()
-    db.refresh(db_curso)
+    await db.commit()
+    response_cache.invalidar("cursos")
     return _normalize_curso_output(db_curso)
 
 @router.delete("/{curso_id}", response_model=dict)
-def eliminar_curso(curso_id: int, db: Session = Depends(get_db)):
-    db_curso = db.query(Curso).filter(Curso.id == curso_id).first()
+async def eliminar_curso(curso_id: int, db: AsyncSession = Depends(get_db)):
+    db_curso = await db.scalar(select(Curso).filter(Curso.id == curso_id))
     if not db_curso:
         raise HTTPException(status_code=404, detail="Curso no encontrado")
-    db.delete(db_curso)
-    db.commit()
+    await db.delete(db_curso)
+    await db.commit()
+    response_cache.invalidar("cursos")
     return {"detail": "Curso eliminado exitosamente"}
 
 
-def _normalize_curso_output(curso: Curso):
+def _normalize_curso_output(curso: Curso, campos: Optional[Sequence[str]] = None):
     """Return a dict-like object that always has imagen_url resolved.
-    If imagen_url is relative, prepend BASE_URL env var if available."""
+    If imagen_url is relative, prepend BASE_URL env var if available.
+    With `campos`, only those keys are returned (and only those columns are
+    read, so deferred columns are never loaded)."""
     base = os.environ.get('BASE_URL') or os.environ.get('BACKEND_BASE_URL') or ''
     img = getattr(curso, 'imagen_url', None) or getattr(curso, 'imagen', None) or ''
     if img and base and not img.lower().startswith('http'):
         img = f"{base.rstrip('/')}/{img.lstrip('/')}"
 
     # Build a dict with model fields plus imagen_url
-    data = {col: getattr(curso, col) for col in curso.__table__.columns.keys()}
-    data['imagen_url'] = img or None
+    if campos is None:
+        data = {col: getattr(curso, col) for col in curso.__table__.columns.keys()}
+        data['imagen_url'] = img or None
+        return data
+    columnas = curso.__table__.columns.keys()
+    data = {c: getattr(curso, c) if c in columnas else None for c in campos}
+    if 'imagen_url' in data:
+        data['imagen_url'] = img or None
     return data
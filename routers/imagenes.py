@@ -0,0 +1,134 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from starlette.datastructures import UploadFile
+
+from routers.auth import get_current_user_id
+from services.blob_store import BlobStore, blob_store, fotos_validacion, ArchivoNoEsImagen, TAMANOS_DERIVADOS
+from services.response_cache import coincide_etag
+from services.uploads import leer_formulario
+
+router = APIRouter(prefix="/imagenes", tags=["Imágenes"])
+
+# Tamaño máximo de una imagen subida a /imagenes/
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# El contenido de una URL nunca cambia (el nombre es su SHA-256): los
+# clientes y CDNs pueden guardarla un año sin volver a validarla
+CACHE_CONTROL_INMUTABLE = "public, max-age=31536000, immutable"
+# Fotos de validaciones QR: solo la caché del propio cliente, nunca una
+# compartida (proxy o CDN)
+CACHE_CONTROL_PRIVADO = "private, max-age=31536000, immutable"
+
+
+def url_imagen(digest: str) -> str:
+    return f"/imagenes/{digest}"
+
+
+def url_foto_validacion(digest: str) -> str:
+    return f"/imagenes/validaciones/{digest}"
+
+
+def _no_modificado(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    if coincide_etag(request.headers.get("if-none-match"), etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": cache_control},
+        )
+    return None
+
+
+async def _servir_original(store: BlobStore, digest: str, request: Request, cache_control: str) -> Response:
+    if not store.existe(digest):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Imagen no encontrada")
+    # El hash es el ETag: si el cliente ya la tiene, 304 sin abrir el archivo
+    etag = f'"{digest}"'
+    no_modificado = _no_modificado(request, etag, cache_control)
+    if no_modificado is not None:
+        return no_modificado
+    media_type = await run_in_threadpool(store.tipo_mime, digest)
+    return FileResponse(
+        store.ruta_original(digest), media_type=media_type,
+        headers={"ETag": etag, "Cache-Control": cache_control},
+    )
+
+
+async def _servir_derivado(store: BlobStore, digest: str, tamano: str, request: Request, cache_control: str) -> Response:
+    if tamano not in TAMANOS_DERIVADOS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tamaño no válido. Disponibles: {', '.join(TAMANOS_DERIVADOS)}",
+        )
+    if not store.existe(digest):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Imagen no encontrada")
+    # Si el cliente ya lo tiene, responder 304 sin leer ni generar el derivado
+    etag = f'"{digest}-{tamano}"'
+    no_modificado = _no_modificado(request, etag, cache_control)
+    if no_modificado is not None:
+        return no_modificado
+    ruta = await run_in_threadpool(store.derivado, digest, tamano)
+    if ruta is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Imagen no encontrada")
+    return FileResponse(ruta, media_type="image/jpeg", headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def subir_imagen(request: Request, current_user_id: int = Depends(get_current_user_id)):
+    """
+    Sube una imagen (multipart/form-data, campo `image`) y devuelve su URL.
+    Subir dos veces el mismo archivo devuelve la misma URL sin duplicarlo.
+    La URL se usa tal cual en `Producto.imagen` o `imagen_url` de cursos.
+    """
+    form = await leer_formulario(request, IMAGE_UPLOAD_MAX_BYTES)
+    try:
+        imagen = form.get("image")
+        if not isinstance(imagen, UploadFile):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Se requiere el campo image")
+        try:
+            digest = await run_in_threadpool(blob_store.guardar, imagen.file)
+        except ArchivoNoEsImagen:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="El archivo no es una imagen válida o sus dimensiones superan el máximo permitido",
+            )
+    finally:
+        await form.close()
+    return {
+        "hash": digest,
+        "url": url_imagen(digest),
+        "derivados": {tamano: f"{url_imagen(digest)}/{tamano}" for tamano in TAMANOS_DERIVADOS},
+    }
+
+
+@router.get("/validaciones/{digest}")
+async def obtener_foto_validacion(
+    digest: str, request: Request, current_user_id: int = Depends(get_current_user_id),
+):
+    """Foto de una validación QR (la URL queda en qr_transactions). Requiere token."""
+    return await _servir_original(fotos_validacion, digest, request, CACHE_CONTROL_PRIVADO)
+
+
+@router.get("/validaciones/{digest}/{tamano}")
+async def obtener_derivado_foto_validacion(
+    digest: str, tamano: str, request: Request, current_user_id: int = Depends(get_current_user_id),
+):
+    """Versión reducida (`thumb` o `card`) de la foto de una validación QR. Requiere token."""
+    return await _servir_derivado(fotos_validacion, digest, tamano, request, CACHE_CONTROL_PRIVADO)
+
+
+@router.get("/{digest}")
+async def obtener_imagen(digest: str, request: Request):
+    """Imagen original tal como se subió."""
+    return await _servir_original(blob_store, digest, request, CACHE_CONTROL_INMUTABLE)
+
+
+@router.get("/{digest}/{tamano}")
+async def obtener_derivado(digest: str, tamano: str, request: Request):
+    """
+    Versión reducida de la imagen (`thumb` o `card`) en JPEG. Se genera la
+    primera vez que se pide y queda guardada en disco.
+    """
+    return await _servir_derivado(blob_store, digest, tamano, request, CACHE_CONTROL_INMUTABLE)
@@ -1,72 +1,146 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import func, or_, select
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Producto, Usuario
-from schemas import ProductoCreate, ProductoOut
-from database import SessionLocal
+from schemas import ProductoCreate, ProductoOut, CategoriaFacet, CotizacionCarrito, CotizacionCarritoOut
+from database import get_db
+from services.carrito import agrupar_items, cargar_productos, CarritoDemasiadoGrande, ProductosNoEncontrados
+from services.pagination import paginar, PAGINATION_MAX_LIMIT
+from services.response_cache import response_cache
 
 router = APIRouter(prefix="/marketplace", tags=["Marketplace"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+_lista_productos = TypeAdapter(list[ProductoOut])
+_lista_categorias = TypeAdapter(list[CategoriaFacet])
+
+# Órdenes aceptados por `orden`; "-" indica descendente. Todas las columnas
+# son NOT NULL para que el cursor (columna, id) sea válido.
+ORDENES_PRODUCTOS = {
+    "id": Producto.id,
+    "precio": Producto.precio,
+    "nombre": Producto.nombre,
+}
 
 def calcular_descuento(cleanpoints: int, puntos_por_descuento: int = 10, max_descuento: int = 50) -> int:
     return min(cleanpoints // puntos_por_descuento, max_descuento)
 
 @router.post("/productos/", response_model=ProductoOut)
-def crear_producto(producto: ProductoCreate, db: Session = Depends(get_db)):
-    if db.query(Producto).filter(Producto.nombre == producto.nombre).first():
+async def crear_producto(producto: ProductoCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(Producto).filter(Producto.nombre == producto.nombre)):
         raise HTTPException(status_code=400, detail="Ya existe un producto con ese nombre")
     db_producto = Producto(**producto.dict())
     db.add(db_producto)
-    db.commit()
-    db.refresh(db_producto)
+    await db.commit()
+    response_cache.invalidar("productos")
     return db_producto
 
 @router.get("/productos/", response_model=list[ProductoOut])
-def listar_productos(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return db.query(Producto).offset(skip).limit(limit).all()
+async def listar_productos(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    categoria: Optional[str] = None,
+    disponible: Optional[bool] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    puntos_min: Optional[int] = Query(None, ge=0),
+    puntos_max: Optional[int] = Query(None, ge=0),
+    en_stock: bool = Query(False, description="Solo productos con stock > 0 (o sin control de stock)"),
+    orden: str = Query("id", description="id, precio o nombre; con '-' delante para orden descendente"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Catálogo filtrado y ordenado en la base de datos. Los filtros más
+    comunes (categoría + disponibilidad, ordenados por precio) usan los
+    índices compuestos de `productos`.
+    """
+    descendente = orden.startswith("-")
+    columna = ORDENES_PRODUCTOS.get(orden.lstrip("-"))
+    if columna is None:
+        raise HTTPException(status_code=400, detail=f"Orden no válido. Disponibles: {', '.join(ORDENES_PRODUCTOS)}")
+
+    query = select(Producto)
+    if categoria is not None:
+        query = query.where(Producto.categoria == categoria)
+    if disponible is not None:
+        query = query.where(Producto.disponible == int(disponible))
+    if precio_min is not None:
+        query = query.where(Producto.precio >= precio_min)
+    if precio_max is not None:
+        query = query.where(Producto.precio <= precio_max)
+    if puntos_min is not None:
+        query = query.where(Producto.puntos_requeridos >= puntos_min)
+    if puntos_max is not None:
+        query = query.where(Producto.puntos_requeridos <= puntos_max)
+    if en_stock:
+        query = query.where(or_(Producto.stock.is_(None), Producto.stock > 0))
+    columnas = [Producto.id] if columna is Producto.id else [columna, Producto.id]
+
+    # JSON ya serializado con ETag; se invalida al crear/editar/eliminar productos
+    async def generar(response: Response):
+        return await paginar(db, query, columnas, response, limit, cursor, skip, descendente=descendente)
+    return await response_cache.responder("productos", request, _lista_productos, generar)
+
+@router.get("/productos/categorias", response_model=list[CategoriaFacet])
+async def contar_por_categoria(
+    request: Request,
+    disponible: Optional[bool] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Número de productos por categoría (faceta del catálogo). Es un conteo
+    sobre el índice (categoria, disponible, ...) y queda en la caché de
+    respuestas hasta que cambie algún producto.
+    """
+    async def generar(response: Response):
+        query = select(Producto.categoria, func.count().label("total")).group_by(Producto.categoria)
+        if disponible is not None:
+            query = query.where(Producto.disponible == int(disponible))
+        result = await db.execute(query.order_by(Producto.categoria))
+        return [{"categoria": categoria, "total": total} for categoria, total in result]
+    return await response_cache.responder("productos", request, _lista_categorias, generar)
 
 @router.get("/productos/{producto_id}", response_model=ProductoOut)
-def obtener_producto(producto_id: int, db: Session = Depends(get_db)):
-    producto = db.query(Producto).filter(Producto.id == producto_id).first()
+async def obtener_producto(producto_id: int, db: AsyncSession = Depends(get_db)):
+    producto = await db.scalar(select(Producto).filter(Producto.id == producto_id))
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     return producto
 
 @router.put("/productos/{producto_id}", response_model=ProductoOut)
-def actualizar_producto(producto_id: int, producto: ProductoCreate, db: Session = Depends(get_db)):
-    db_producto = db.query(Producto).filter(Producto.id == producto_id).first()
+async def actualizar_producto(producto_id: int, producto: ProductoCreate, db: AsyncSession = Depends(get_db)):
+    db_producto = await db.scalar(select(Producto).filter(Producto.id == producto_id))
     if not db_producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     for key, value in producto.dict().items():
         setattr(db_producto, key, value)
-    db.commit()
-    db.refresh(db_producto)
+    await db.commit()
+    response_cache.invalidar("productos")
     return db_producto
 
 @router.delete("/productos/{producto_id}", response_model=dict)
-def eliminar_producto(producto_id: int, db: Session = Depends(get_db)):
-    db_producto = db.query(Producto).filter(Producto.id == producto_id).first()
+async def eliminar_producto(producto_id: int, db: AsyncSession = Depends(get_db)):
+    db_producto = await db.scalar(select(Producto).filter(Producto.id == producto_id))
     if not db_producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    db.delete(db_producto)
-    db.commit()
+    await db.delete(db_producto)
+    await db.commit()
+    response_cache.invalidar("productos")
     return {"detail": "Producto eliminado exitosamente"}
 
 @router.post("/canjear/", response_model=dict)
-def canjear_marketplace(
+async def canjear_marketplace(
     usuario_id: int = Body(..., embed=True),
     producto_id: int = Body(..., embed=True),
     precio_base: float = Body(..., embed=True),
     puntos_por_descuento: int = 10,
     max_descuento: int = 50,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    usuario = await db.scalar(select(Usuario).filter(Usuario.id == usuario_id))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     descuento = calcular_descuento(usuario.cleanpoints, puntos_por_descuento, max_descuento)
@@ -79,4 +153,51 @@ def canjear_marketplace(
         "descuento_aplicado": f"{descuento}%",
         "precio_final": round(precio_final, 2),
         "detalle": f"Descuento de {descuento}% aplicado por {usuario.cleanpoints} cleanpoints"
-    }
\ No newline at end of file
+    }
+
+@router.post("/canjear/lote", response_model=CotizacionCarritoOut)
+async def cotizar_carrito(
+    carrito: CotizacionCarrito,
+    puntos_por_descuento: int = 10,
+    max_descuento: int = 50,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Cotiza un carrito completo con el descuento por CleanPoints del usuario:
+    una consulta para el usuario y otra (`IN`) para todos los productos, en
+    vez de un /canjear/ por ítem. El precio base es el del catálogo.
+    """
+    try:
+        cantidades = agrupar_items(carrito.items)
+    except CarritoDemasiadoGrande as e:
+        raise HTTPException(status_code=400, detail=f"El carrito admite como máximo {e.args[0]} unidades")
+    usuario = await db.scalar(select(Usuario).filter(Usuario.id == carrito.usuario_id))
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    try:
+        productos = await cargar_productos(db, cantidades)
+    except ProductosNoEncontrados as e:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(map(str, e.args[0]))}")
+
+    # El descuento depende solo del saldo del usuario: se calcula una vez
+    descuento = calcular_descuento(usuario.cleanpoints, puntos_por_descuento, max_descuento)
+    lineas = []
+    for producto_id, cantidad in cantidades.items():
+        precio_base = float(productos[producto_id].precio)
+        precio_final = round(precio_base * (1 - descuento / 100), 2)
+        lineas.append({
+            "producto_id": producto_id,
+            "nombre": productos[producto_id].nombre,
+            "cantidad": cantidad,
+            "precio_base": precio_base,
+            "precio_final": precio_final,
+            "subtotal": round(precio_final * cantidad, 2),
+        })
+    return {
+        "usuario_id": carrito.usuario_id,
+        "cleanpoints_usuario": usuario.cleanpoints,
+        "descuento_aplicado": f"{descuento}%",
+        "items": lineas,
+        "total_base": round(sum(l["precio_base"] * l["cantidad"] for l in lineas), 2),
+        "total_final": round(sum(l["subtotal"] for l in lineas), 2),
+    }
@@ -1,102 +1,201 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.datastructures import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from datetime import datetime, timedelta
+import asyncio
 import base64
 import io
-from PIL import Image
+import os
+import secrets
+import time
+import uuid
+from typing import Awaitable, BinaryIO, Callable, Optional
 import numpy as np
 
-from models import Usuario
-from schemas import QRValidationRequest, QRValidationResponse
-from database import SessionLocal
-from routers.auth import get_current_user
+from models import Usuario, TrabajoValidacion
+from schemas import QRValidationRequest, QRValidationResponse, QRJobOut
+from database import get_db, AsyncSessionLocal
+from routers.auth import get_current_user_id
+from services.points import aplicar_puntos, MOTIVO_QR
+from services.inference import scheduler, ColaInferenciaLlena, INFERENCE_THRESHOLD
+from services.model_registry import (
+    registry, resolver_ruta_modelo, RutaModeloInvalida,
+    MODEL_PATH, MODEL_RELOAD_TOKEN, FORMA_ENTRADA,
+)
+from services.uploads import leer_formulario
+from services.preprocessing import cargar_para_modelo, ImagenDemasiadoGrande
+from services.image_cache import image_cache, dhash
+from services.jobs import (
+    WorkerPool, TrabajoPerdido, WORKER_ID, QR_JOB_LEASE_SECONDS,
+    completed_counter, failed_counter, lost_counter,
+)
+from services.qr_audit import qr_auditoria
+from services.stats import registrar_validacion
+from services.blob_store import fotos_validacion, ArchivoNoEsImagen
+from routers.imagenes import url_foto_validacion
 
 router = APIRouter(prefix="/qr", tags=["Validación QR"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Tamaño de entrada del modelo de clasificación (alto, ancho)
+TAMANO_ENTRADA = FORMA_ENTRADA[:2]
+# Tamaño máximo de la foto subida a /qr/validate/upload
+QR_UPLOAD_MAX_BYTES = int(os.getenv("QR_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+# Espera máxima de GET /qr/jobs/{id}?wait=... (long-poll)
+QR_JOB_MAX_WAIT_SECONDS = 30.0
+# Pausa antes de reintentar un trabajo cuando el validador está saturado
+QR_JOB_RETRY_SECONDS = 1.0
+# Durante el long-poll se relee el trabajo con esta frecuencia: el aviso en
+# memoria solo llega si el trabajo lo procesa este mismo proceso
+QR_JOB_POLL_SECONDS = 1.0
+
+ESTADOS_FINALES = ("completado", "error")
+
+def preprocesar_imagen(fp: BinaryIO) -> np.ndarray:
+    """
+    Convierte la imagen de `fp` al tensor de entrada del modelo
+    (alto, ancho, 3) en float32 normalizado a [0, 1], decodificando
+    directamente a baja resolución (ver services/preprocessing.py).
+    """
+    return cargar_para_modelo(fp, TAMANO_ENTRADA)
 
-def validate_recycling_image(image_data: str) -> bool:
+async def _puntuar(fp: BinaryIO) -> bool:
     """
-    Función para validar si la imagen muestra reciclaje válido.
-    En un caso real, aquí usarías un modelo de IA entrenado.
-    Por ahora, simulamos la validación.
+    Busca primero una foto casi idéntica en la caché de hashes perceptuales;
+    si no la hay, preprocesa la imagen en el threadpool y la encola en el
+    planificador de inferencia, que la evalúa junto con las de otros requests
+    en un solo lote.
     """
     try:
-        # Decodificar imagen base64
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convertir a array numpy para análisis
-        img_array = np.array(image)
-        
-        # Simulación de validación de IA
-        # En un caso real, aquí pasarías la imagen a tu modelo de IA
-        
-        # Por ahora, simulamos que el 80% de las imágenes son válidas
-        # Esto es solo para demostración
-        import random
-        is_valid = random.random() < 0.8
-        
-        return is_valid
-        
+        huella = await run_in_threadpool(dhash, fp)
+    except ImagenDemasiadoGrande:
+        raise
+    except Exception:
+        huella = None
+    if huella is not None:
+        veredicto = image_cache.buscar(huella)
+        if veredicto is not None:
+            return veredicto
+
+    try:
+        fp.seek(0)
+        tensor = await run_in_threadpool(preprocesar_imagen, fp)
+    except ImagenDemasiadoGrande:
+        raise
     except Exception as e:
         print(f"Error procesando imagen: {e}")
         return False
 
-@router.post("/validate", response_model=QRValidationResponse)
-def validate_qr(
-    qr_data: QRValidationRequest, 
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
-):
+    score = await scheduler.submit(tensor)
+    is_valid = score >= INFERENCE_THRESHOLD
+    if huella is not None:
+        image_cache.guardar(huella, is_valid)
+    return is_valid
+
+async def _guardar_foto(fp: BinaryIO) -> Optional[str]:
     """
-    Valida el reciclaje basado en el código QR y la imagen.
+    Guarda la foto en el almacén de fotos de validación
+    (services/blob_store.py) y devuelve su URL, que solo se sirve con token;
+    una foto repetida no ocupa espacio extra. Un error al
+    guardarla no afecta a la validación.
+    """
+    try:
+        fp.seek(0)
+        return url_foto_validacion(await run_in_threadpool(fotos_validacion.guardar, fp))
+    except ArchivoNoEsImagen:
+        return None
+    except Exception as e:
+        print(f"Error guardando la foto de la validación: {e}")
+        return None
+
+def _validador_no_disponible(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+async def _validar_y_otorgar(
+    db: AsyncSession,
+    user_id: int,
+    qr_code: str,
+    validar: Callable[[], Awaitable[bool]],
+    trabajo: Optional[TrabajoValidacion] = None,
+    foto: Optional[BinaryIO] = None,
+) -> QRValidationResponse:
+    """
+    Flujo común de validación: verifica el usuario, ejecuta `validar` y otorga
+    los CleanPoints si la imagen es válida. Si se pasa `trabajo`, se cierra
+    con un UPDATE condicional (sigue reclamado por este proceso) en la misma
+    transacción que los puntos: si otro proceso lo retomó, lanza
+    TrabajoPerdido sin otorgarlos, así nunca se otorgan dos veces. `foto` se
+    guarda en el almacén de imágenes y su URL queda en la auditoría.
     """
     try:
         # Verificar que el usuario existe
-        user = db.query(Usuario).filter(Usuario.id == qr_data.user_id).first()
+        # Si es el usuario autenticado, db.get lo toma del identity map de la sesión
+        user = await db.get(Usuario, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Usuario no encontrado"
             )
         
-        # Validar la imagen usando IA (simulado)
-        is_valid = validate_recycling_image(qr_data.image_data)
+        # Validar la imagen usando IA (por lotes, ver services/inference.py)
+        if not registry.listo:
+            raise _validador_no_disponible("El validador se está iniciando, inténtalo de nuevo en unos segundos")
+        try:
+            is_valid = await validar()
+        except ColaInferenciaLlena:
+            raise _validador_no_disponible("El validador está saturado, inténtalo de nuevo en unos segundos")
+        except ImagenDemasiadoGrande:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Las dimensiones de la imagen superan el máximo permitido"
+            )
         
         # Determinar puntos a otorgar
         cleanpoints_earned = 50 if is_valid else 0
+        ahora = datetime.utcnow()
         
         # Mensaje de respuesta
         if is_valid:
             message = "¡Reciclaje validado exitosamente! Has ganado 50 CleanPoints por contribuir al medio ambiente."
-            
-            # Actualizar CleanPoints del usuario
-            user.cleanpoints += cleanpoints_earned
-            # Incrementar conteo de items reciclados (persistente)
-            if getattr(user, 'total_recycled_items', None) is None:
-                user.total_recycled_items = 0
-            user.total_recycled_items += 1
-            db.commit()
         else:
             message = "La imagen no muestra un reciclaje válido. Por favor, asegúrate de que la imagen muestre claramente el material a reciclar."
         
+        if trabajo is not None:
+            await _completar_trabajo(db, trabajo.id, is_valid, cleanpoints_earned, message, ahora)
+        
+        if is_valid:
+            # Sumar CleanPoints e incrementar el conteo de items reciclados
+            # con un único UPDATE atómico en la base de datos
+            await aplicar_puntos(db, user.id, cleanpoints_earned, MOTIVO_QR, qr_code, items_reciclados=1)
+            # Estadísticas por día y por hora, en la misma transacción
+            await registrar_validacion(db, user.id, cleanpoints_earned, ahora)
+        
         # Crear respuesta
         response = QRValidationResponse(
             success=True,
             valid=is_valid,
             cleanpoints_earned=cleanpoints_earned,
             message=message,
-            timestamp=datetime.utcnow()
+            timestamp=ahora
+        )
+        
+        if is_valid or trabajo is not None:
+            await db.commit()
+        # Auditoría de la validación: se escribe en segundo plano por lotes
+        image_url = await _guardar_foto(foto) if foto is not None else None
+        qr_auditoria.registrar(
+            user_id, qr_code, cleanpoints_earned, is_valid,
+            image_url=image_url, created_at=response.timestamp,
         )
         
         return response
         
+    except (HTTPException, TrabajoPerdido):
+        raise
     except Exception as e:
         print(f"Error en validación QR: {e}")
         raise HTTPException(
@@ -104,8 +203,309 @@ def validate_qr(
             detail="Error interno del servidor durante la validación"
         )
 
+def _trabajo_out(trabajo: TrabajoValidacion) -> QRJobOut:
+    return QRJobOut(
+        job_id=trabajo.id,
+        status=trabajo.estado,
+        valid=trabajo.valido,
+        cleanpoints_earned=trabajo.cleanpoints_earned or 0,
+        message=trabajo.mensaje,
+        created_at=trabajo.fecha_creacion,
+        finished_at=trabajo.fecha_fin,
+    )
+
+async def _crear_trabajo(db: AsyncSession, user_id: int, qr_code: str, imagen: bytes) -> JSONResponse:
+    """
+    Persiste la foto como trabajo pendiente, lo encola y responde 202 con el id
+    para consultar el resultado en GET /qr/jobs/{id}.
+    """
+    user = await db.get(Usuario, user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+    trabajo = TrabajoValidacion(
+        id=uuid.uuid4().hex,
+        usuario_id=user_id,
+        qr_code=qr_code,
+        imagen=imagen,
+        estado="pendiente",
+        cleanpoints_earned=0,
+        fecha_creacion=datetime.utcnow(),
+    )
+    db.add(trabajo)
+    await db.commit()
+    trabajos.encolar(trabajo.id)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(_trabajo_out(trabajo)),
+        headers={"Location": f"/qr/jobs/{trabajo.id}"},
+    )
+
+def _reclamado_por_mi():
+    return and_(TrabajoValidacion.estado == "procesando", TrabajoValidacion.worker_id == WORKER_ID)
+
+def _reclamable(ahora: datetime):
+    """Pendiente, o en proceso con el reclamo vencido (su dueño murió o se reinició)."""
+    vencido = ahora - timedelta(seconds=QR_JOB_LEASE_SECONDS)
+    return or_(
+        TrabajoValidacion.estado == "pendiente",
+        and_(
+            TrabajoValidacion.estado == "procesando",
+            or_(TrabajoValidacion.fecha_reclamo.is_(None), TrabajoValidacion.fecha_reclamo < vencido),
+        ),
+    )
+
+async def _actualizar_si_reclamado(db: AsyncSession, job_id: str, **valores) -> bool:
+    """UPDATE del trabajo solo si sigue reclamado por este proceso. No hace commit."""
+    result = await db.execute(
+        update(TrabajoValidacion)
+        .where(TrabajoValidacion.id == job_id, _reclamado_por_mi())
+        .values(**valores)
+    )
+    return result.rowcount == 1
+
+async def _completar_trabajo(
+    db: AsyncSession, job_id: str, is_valid: bool, cleanpoints_earned: int, message: str, fin: datetime,
+):
+    completado = await _actualizar_si_reclamado(
+        db, job_id,
+        estado="completado", valido=is_valid, cleanpoints_earned=cleanpoints_earned,
+        mensaje=message, imagen=None, fecha_fin=fin,
+    )
+    if not completado:
+        raise TrabajoPerdido(job_id)
+
+async def _procesar_trabajo(job_id: str):
+    """
+    Worker de un trabajo asíncrono: lo reclama con un UPDATE condicional
+    (worker_id + fecha_reclamo), lo valida con el mismo flujo que
+    /qr/validate y guarda el resultado. Si el validador está saturado o
+    iniciándose, renueva el reclamo, espera y reintenta. Si el reclamo
+    venció y otro proceso retomó el trabajo, lo abandona sin tocarlo.
+    """
+    async with AsyncSessionLocal() as db:
+        ahora = datetime.utcnow()
+        reclamado = await db.execute(
+            update(TrabajoValidacion)
+            .where(TrabajoValidacion.id == job_id, _reclamable(ahora))
+            .values(estado="procesando", worker_id=WORKER_ID, fecha_reclamo=ahora)
+        )
+        await db.commit()
+        if reclamado.rowcount == 0:
+            return
+        while True:
+            trabajo = await db.get(TrabajoValidacion, job_id, populate_existing=True)
+            foto = io.BytesIO(trabajo.imagen or b"")
+            try:
+                await _validar_y_otorgar(
+                    db, trabajo.usuario_id, trabajo.qr_code,
+                    lambda: _puntuar(foto),
+                    trabajo=trabajo,
+                    foto=foto,
+                )
+                completed_counter.inc()
+                return
+            except TrabajoPerdido:
+                await db.rollback()
+                lost_counter.inc()
+                return
+            except HTTPException as e:
+                # Libera la conexión antes de esperar o registrar el error
+                await db.rollback()
+                if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+                    renovado = await _actualizar_si_reclamado(db, job_id, fecha_reclamo=datetime.utcnow())
+                    await db.commit()
+                    if not renovado:
+                        lost_counter.inc()
+                        return
+                    await asyncio.sleep(QR_JOB_RETRY_SECONDS)
+                    continue
+                fallido = await _actualizar_si_reclamado(
+                    db, job_id,
+                    estado="error", mensaje=e.detail, imagen=None, fecha_fin=datetime.utcnow(),
+                )
+                await db.commit()
+                (failed_counter if fallido else lost_counter).inc()
+                return
+
+async def _buscar_trabajos():
+    """Ids de los trabajos que este proceso puede reclamar, del más antiguo al más reciente."""
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(
+            select(TrabajoValidacion.id)
+            .where(_reclamable(datetime.utcnow()))
+            .order_by(TrabajoValidacion.fecha_creacion)
+        )).all()
+
+trabajos = WorkerPool(_procesar_trabajo, buscar=_buscar_trabajos)
+
+async def recuperar_trabajos():
+    """
+    Arranca los workers y vuelve a encolar los trabajos pendientes y los que
+    quedaron a medio procesar con el reclamo vencido (sus puntos aún no se
+    habían otorgado). Los que otro proceso vivo está procesando no se tocan;
+    si ese proceso muere, se retoman cuando vence su reclamo.
+    """
+    trabajos.start(await _buscar_trabajos())
+
+@router.post(
+    "/validate",
+    response_model=QRValidationResponse,
+    responses={202: {"model": QRJobOut, "description": "Trabajo aceptado (asincrono=true)"}},
+)
+async def validate_qr(
+    qr_data: QRValidationRequest, 
+    asincrono: bool = Query(False, description="Responder 202 con un trabajo en vez de esperar la validación"),
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Valida el reciclaje basado en el código QR y la imagen (base64 en JSON).
+    Se mantiene por compatibilidad; los clientes nuevos deberían usar
+    /qr/validate/upload.
+    """
+    try:
+        imagen = await run_in_threadpool(base64.b64decode, qr_data.image_data)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La imagen no es base64 válido"
+        )
+    if len(imagen) > QR_UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="El archivo supera el tamaño máximo permitido"
+        )
+    if asincrono:
+        return await _crear_trabajo(db, qr_data.user_id, qr_data.qr_code, imagen)
+    foto = io.BytesIO(imagen)
+    return await _validar_y_otorgar(
+        db, qr_data.user_id, qr_data.qr_code,
+        lambda: _puntuar(foto),
+        foto=foto,
+    )
+
+@router.post(
+    "/validate/upload",
+    response_model=QRValidationResponse,
+    responses={202: {"model": QRJobOut, "description": "Trabajo aceptado (asincrono=true)"}},
+)
+async def validate_qr_upload(
+    request: Request,
+    asincrono: bool = Query(False, description="Responder 202 con un trabajo en vez de esperar la validación"),
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Variante multipart/form-data de /qr/validate con los campos `qr_code`,
+    `user_id` e `image` (archivo). La foto se recibe en streaming a un buffer
+    temporal con límite de tamaño y PIL la lee desde ahí sin copias extra.
+    """
+    form = await leer_formulario(request, QR_UPLOAD_MAX_BYTES)
+    try:
+        imagen = form.get("image")
+        qr_code = form.get("qr_code")
+        user_id = form.get("user_id")
+        if not isinstance(imagen, UploadFile) or not qr_code or not str(user_id).isdigit():
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Se requieren los campos qr_code, user_id e image"
+            )
+        if asincrono:
+            return await _crear_trabajo(db, int(user_id), str(qr_code), await imagen.read())
+        return await _validar_y_otorgar(
+            db, int(user_id), str(qr_code),
+            lambda: _puntuar(imagen.file),
+            foto=imagen.file,
+        )
+    finally:
+        await form.close()
+
+@router.get("/jobs/{job_id}", response_model=QRJobOut)
+async def estado_trabajo(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Segundos a esperar a que el trabajo termine (long-poll, máx. 30)"),
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Estado y resultado de un trabajo de validación. Con `wait` la respuesta
+    se retiene hasta que el trabajo termina o vence la espera.
+    """
+    wait = min(wait, QR_JOB_MAX_WAIT_SECONDS)
+    limite = time.monotonic() + wait
+    evento = trabajos.suscribir(job_id) if wait > 0 else None
+    try:
+        trabajo = await db.get(TrabajoValidacion, job_id, options=[defer(TrabajoValidacion.imagen)])
+        if not trabajo:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Trabajo no encontrado"
+            )
+        while evento is not None and trabajo.estado not in ESTADOS_FINALES:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            # No retener una conexión del pool durante la espera
+            await db.rollback()
+            # El aviso solo llega si el trabajo lo procesa este proceso: con
+            # varios workers se relee la fila cada QR_JOB_POLL_SECONDS
+            pausa = min(restante, QR_JOB_POLL_SECONDS)
+            if evento.is_set():
+                await asyncio.sleep(pausa)
+            else:
+                try:
+                    await asyncio.wait_for(evento.wait(), pausa)
+                except asyncio.TimeoutError:
+                    pass
+            trabajo = await db.get(
+                TrabajoValidacion, job_id,
+                options=[defer(TrabajoValidacion.imagen)], populate_existing=True,
+            )
+    finally:
+        if evento is not None:
+            trabajos.desuscribir(job_id)
+    return _trabajo_out(trabajo)
+
+@router.post("/modelo/recargar")
+async def recargar_modelo(
+    modelo: Optional[str] = Query(None, description="Archivo del modelo dentro de MODELS_DIR (por defecto, MODEL_PATH)"),
+    x_model_reload_token: Optional[str] = Header(None),
+):
+    """
+    Operación interna: carga el modelo (MODEL_PATH, o `modelo` dentro de
+    MODELS_DIR) y lo publica cuando está calentado. Las validaciones en curso
+    terminan con el modelo anterior. Exige la cabecera X-Model-Reload-Token
+    igual a MODEL_RELOAD_TOKEN y solo recarga el proceso que atiende el
+    request.
+    """
+    if not MODEL_RELOAD_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_model_reload_token or not secrets.compare_digest(x_model_reload_token, MODEL_RELOAD_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token de recarga inválido")
+    ruta = MODEL_PATH
+    if modelo is not None:
+        try:
+            ruta = resolver_ruta_modelo(modelo)
+        except RutaModeloInvalida:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El modelo debe ser un archivo existente dentro de MODELS_DIR"
+            )
+    try:
+        version = await registry.cargar(ruta, tamanos_lote=(1, scheduler.max_batch_size))
+    except Exception as e:
+        print(f"Error recargando modelo: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No se pudo cargar el modelo"
+        )
+    return {"message": "Modelo recargado", "version": version}
+
 @router.post("/test")
-def test_qr_endpoint():
+async def test_qr_endpoint():
     """
     Endpoint de prueba para verificar que el router funciona.
     """
@@ -1,40 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from models import Recompensa, Usuario
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Recompensa
 from schemas import RecompensaCreate, RecompensaOut
-from database import SessionLocal
+from database import get_db
+from services.pagination import paginar, PAGINATION_MAX_LIMIT
+from services.points import aplicar_puntos, SaldoInsuficiente, UsuarioNoEncontrado, MOTIVO_RECOMPENSA
 
 router = APIRouter(prefix="/recompensas", tags=["Recompensas"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/", response_model=list[RecompensaOut])
-def listar_recompensas(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return db.query(Recompensa).offset(skip).limit(limit).all()
+async def listar_recompensas(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: AsyncSession = Depends(get_db),
+):
+    return await paginar(db, select(Recompensa), [Recompensa.id], response, limit, cursor, skip)
 
 @router.post("/", response_model=RecompensaOut)
-def crear_recompensa(recompensa: RecompensaCreate, db: Session = Depends(get_db)):
+async def crear_recompensa(recompensa: RecompensaCreate, db: AsyncSession = Depends(get_db)):
     db_recompensa = Recompensa(**recompensa.dict())
     db.add(db_recompensa)
-    db.commit()
-    db.refresh(db_recompensa)
+    await db.commit()
     return db_recompensa
 
 @router.post("/usuarios/{usuario_id}/reclamar/", response_model=RecompensaOut)
-def reclamar_recompensa(usuario_id: int, recompensa: RecompensaCreate, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
-    if not usuario:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    if usuario.cleanpoints < recompensa.puntos_requeridos:
-        raise HTTPException(status_code=400, detail="No tienes suficientes cleanpoints")
-    usuario.cleanpoints -= recompensa.puntos_requeridos
+async def reclamar_recompensa(usuario_id: int, recompensa: RecompensaCreate, db: AsyncSession = Depends(get_db)):
+    # Insertar la recompensa primero para registrar su id en el libro de puntos
     db_recompensa = Recompensa(**recompensa.dict(), usuario_id=usuario_id)
     db.add(db_recompensa)
-    db.commit()
-    db.refresh(db_recompensa)
+    try:
+        await db.flush()
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    try:
+        await aplicar_puntos(db, usuario_id, -recompensa.puntos_requeridos, MOTIVO_RECOMPENSA, db_recompensa.id)
+    except UsuarioNoEncontrado:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    except SaldoInsuficiente:
+        raise HTTPException(status_code=400, detail="No tienes suficientes cleanpoints")
+    await db.commit()
     return db_recompensa
\ No newline at end of file
@@ -0,0 +1,118 @@
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_db
+from models import EstadisticaGlobalHora, EstadisticaUsuarioDia
+from schemas import SerieEstadisticas
+
+router = APIRouter(prefix="/stats", tags=["Estadísticas"])
+
+# Rango por defecto y máximo de las series (en días)
+STATS_DIAS_POR_DEFECTO = 30
+STATS_MAX_DIAS = 366
+# Las series por hora se limitan a un mes (744 puntos)
+STATS_MAX_DIAS_POR_HORA = 31
+
+PASOS = {
+    "hora": timedelta(hours=1),
+    "dia": timedelta(days=1),
+    "semana": timedelta(weeks=1),
+}
+
+
+def _inicio_periodo(momento: datetime, agrupar: str) -> datetime:
+    if agrupar == "hora":
+        return momento.replace(minute=0, second=0, microsecond=0)
+    dia = datetime.combine(momento.date(), time.min)
+    if agrupar == "semana":
+        # Semanas de lunes a domingo
+        return dia - timedelta(days=dia.weekday())
+    return dia
+
+
+def _rango(desde: Optional[date], hasta: Optional[date], agrupar: str) -> Tuple[date, date]:
+    hasta = hasta or datetime.utcnow().date()
+    desde = desde or hasta - timedelta(days=STATS_DIAS_POR_DEFECTO - 1)
+    maximo = STATS_MAX_DIAS_POR_HORA if agrupar == "hora" else STATS_MAX_DIAS
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="`desde` no puede ser posterior a `hasta`")
+    if (hasta - desde).days + 1 > maximo:
+        raise HTTPException(status_code=400, detail=f"El rango máximo con agrupar={agrupar} es de {maximo} días")
+    return desde, hasta
+
+
+def _serie(filas: Iterable[Tuple[datetime, int, int]], desde: date, hasta: date, agrupar: str) -> dict:
+    """Agrupa las filas del rollup por periodo y completa con ceros los periodos sin actividad."""
+    totales = {}
+    for momento, validaciones, cleanpoints in filas:
+        periodo = _inicio_periodo(momento, agrupar)
+        v, p = totales.get(periodo, (0, 0))
+        totales[periodo] = (v + validaciones, p + cleanpoints)
+
+    serie = []
+    periodo = _inicio_periodo(datetime.combine(desde, time.min), agrupar)
+    fin = datetime.combine(hasta, time.max)
+    while periodo <= fin:
+        v, p = totales.get(periodo, (0, 0))
+        serie.append({"periodo": periodo, "validaciones": v, "cleanpoints": p})
+        periodo += PASOS[agrupar]
+    return {
+        "agrupar": agrupar,
+        "desde": desde,
+        "hasta": hasta,
+        "validaciones": sum(punto["validaciones"] for punto in serie),
+        "cleanpoints": sum(punto["cleanpoints"] for punto in serie),
+        "serie": serie,
+    }
+
+
+@router.get("/usuarios/{usuario_id}", response_model=SerieEstadisticas)
+async def estadisticas_usuario(
+    usuario_id: int,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    agrupar: str = Query("dia", pattern="^(dia|semana)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Validaciones exitosas y CleanPoints ganados por el usuario, por día o
+    semana (UTC). Por defecto, los últimos 30 días. Lee solo el rollup diario
+    (clave primaria usuario + día).
+    """
+    desde, hasta = _rango(desde, hasta, agrupar)
+    result = await db.execute(
+        select(EstadisticaUsuarioDia.dia, EstadisticaUsuarioDia.validaciones, EstadisticaUsuarioDia.cleanpoints)
+        .where(
+            EstadisticaUsuarioDia.usuario_id == usuario_id,
+            EstadisticaUsuarioDia.dia >= desde,
+            EstadisticaUsuarioDia.dia <= hasta,
+        )
+    )
+    filas = ((datetime.combine(dia, time.min), v, p) for dia, v, p in result)
+    return _serie(filas, desde, hasta, agrupar)
+
+
+@router.get("/global", response_model=SerieEstadisticas)
+async def estadisticas_globales(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    agrupar: str = Query("dia", pattern="^(hora|dia|semana)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Validaciones exitosas y CleanPoints otorgados en toda la plataforma, por
+    hora (máx. 31 días), día o semana (UTC). Lee solo el rollup por hora.
+    """
+    desde, hasta = _rango(desde, hasta, agrupar)
+    result = await db.execute(
+        select(EstadisticaGlobalHora.hora, EstadisticaGlobalHora.validaciones, EstadisticaGlobalHora.cleanpoints)
+        .where(
+            EstadisticaGlobalHora.hora >= datetime.combine(desde, time.min),
+            EstadisticaGlobalHora.hora < datetime.combine(hasta + timedelta(days=1), time.min),
+        )
+    )
+    return _serie(result, desde, hasta, agrupar)
@@ -1,23 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Usuario, Curso
-from schemas import UsuarioCreate, UsuarioOut
-from database import SessionLocal
-from routers.auth import get_current_user
+from schemas import UsuarioCreate, UsuarioOut, PosicionRanking, RankUsuario, DashboardUsuario
+from database import get_db, marcar_usuario_modificado
+from routers.auth import get_current_user, get_current_user_id
+from services.dashboard import consultar_dashboard, dashboard_cache
+from services.leaderboard import leaderboard
+from services.pagination import PAGINATION_MAX_LIMIT
+from services.points import aplicar_puntos, UsuarioNoEncontrado, MOTIVO_CURSO
 
 router = APIRouter(prefix="/usuarios", tags=["Usuarios"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/", response_model=UsuarioOut)
-def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
+async def crear_usuario(usuario: UsuarioCreate, db: AsyncSession = Depends(get_db)):
     # Verificar si el email ya existe
-    existing_user = db.query(Usuario).filter(Usuario.email == usuario.email).first()
+    existing_user = await db.scalar(select(Usuario).filter(Usuario.email == usuario.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -25,7 +23,7 @@ def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
         )
     
     # Verificar si el nombre ya existe
-    existing_name = db.query(Usuario).filter(Usuario.nombre == usuario.nombre).first()
+    existing_name = await db.scalar(select(Usuario).filter(Usuario.nombre == usuario.nombre))
     if existing_name:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -40,39 +38,119 @@ def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
         cleanpoints=0
     )
     db.add(db_usuario)
-    db.commit()
-    db.refresh(db_usuario)
+    # El id se conoce tras el flush: el usuario entra al ranking al confirmar
+    await db.flush()
+    marcar_usuario_modificado(db, db_usuario.id, 0)
+    await db.commit()
     return db_usuario
 
+# Declarado antes de /{usuario_id} para que "leaderboard" no se tome como id
+@router.get("/leaderboard", response_model=list[PosicionRanking])
+async def ranking(
+    limit: int = Query(10, ge=1, le=PAGINATION_MAX_LIMIT),
+    skip: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Usuarios con más CleanPoints. El orden sale del ranking en memoria
+    (services/leaderboard.py); solo nombre y avatar se leen de la base, por
+    clave primaria, para no mostrar nunca un nombre desactualizado.
+    """
+    posiciones = leaderboard.top(limit, skip)
+    if not posiciones:
+        return []
+    result = await db.execute(
+        select(Usuario.id, Usuario.nombre, Usuario.avatar)
+        .where(Usuario.id.in_([p.usuario_id for p in posiciones]))
+    )
+    perfiles = {row.id: row for row in result}
+    return [
+        {
+            "posicion": p.posicion,
+            "usuario_id": p.usuario_id,
+            "nombre": perfiles[p.usuario_id].nombre,
+            "avatar": perfiles[p.usuario_id].avatar,
+            "cleanpoints": p.cleanpoints,
+        }
+        for p in posiciones
+        if p.usuario_id in perfiles
+    ]
+
+@router.get("/{usuario_id}/rank", response_model=RankUsuario)
+async def posicion_usuario(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    """Posición del usuario en el ranking, sin consultar la base."""
+    posicion = leaderboard.posicion(usuario_id)
+    if posicion is None:
+        # Usuario creado en otro worker desde la última reconstrucción
+        usuario = await db.get(Usuario, usuario_id)
+        if not usuario:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        leaderboard.actualizar(usuario_id, usuario.cleanpoints or 0)
+        posicion = leaderboard.posicion(usuario_id)
+    return {
+        "usuario_id": usuario_id,
+        "cleanpoints": posicion.cleanpoints,
+        "posicion": posicion.posicion,
+        "total_usuarios": len(leaderboard),
+    }
+
+@router.get("/{usuario_id}/dashboard", response_model=DashboardUsuario)
+async def dashboard_usuario(
+    usuario_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Todo lo que muestra la pantalla de perfil en una sola llamada: saldo,
+    items reciclados, CleanPoints ganados y gastados, últimas compras y
+    recompensas. Es una única consulta SQL y queda cacheado unos segundos
+    por usuario (hasta el próximo movimiento de puntos).
+    """
+    if current_user_id != usuario_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tienes permisos para ver el panel de otro usuario"
+        )
+    panel = dashboard_cache.buscar(usuario_id)
+    if panel is None:
+        marca = dashboard_cache.marca()
+        panel = await consultar_dashboard(db, usuario_id)
+        if panel is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        dashboard_cache.guardar(usuario_id, panel, marca)
+    return panel
+
 @router.get("/{usuario_id}", response_model=UsuarioOut)
-def obtener_usuario(usuario_id: int, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+async def obtener_usuario(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    usuario = await db.scalar(select(Usuario).filter(Usuario.id == usuario_id))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return usuario
 
 @router.get("/{usuario_id}/cleanpoints", response_model=int)
-def consultar_cleanpoints(usuario_id: int, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+async def consultar_cleanpoints(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    usuario = await db.scalar(select(Usuario).filter(Usuario.id == usuario_id))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return usuario.cleanpoints
 
 @router.put("/{usuario_id}", response_model=UsuarioOut)
-def actualizar_usuario(
+async def actualizar_usuario(
     usuario_id: int, 
     usuario_data: dict, 
-    db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
 ):
     # Verificar que el usuario actual está actualizando su propio perfil
-    if current_user.id != usuario_id:
+    if current_user_id != usuario_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="No tienes permisos para actualizar este usuario"
         )
     
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    # Si la autenticación no salió de la caché, esta fila ya está en la
+    # sesión y db.get la toma del identity map sin volver a consultar.
+    usuario = await db.get(Usuario, usuario_id)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
@@ -81,15 +159,17 @@ def actualizar_usuario(
         if hasattr(usuario, field) and field not in ['id', 'password_hash']:
             setattr(usuario, field, value)
     
-    db.commit()
-    db.refresh(usuario)
+    # Descartar los snapshots cacheados del usuario al confirmar (y reflejar
+    # el saldo en el ranking, por si se modificó)
+    marcar_usuario_modificado(db, usuario_id, usuario.cleanpoints)
+    await db.commit()
     return usuario
 
 @router.post("/{usuario_id}/completar_curso/{curso_id}", response_model=UsuarioOut)
-def completar_curso(
+async def completar_curso(
     usuario_id: int, 
     curso_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
     # Verificar que el usuario actual está completando su propio curso
@@ -99,14 +179,16 @@ def completar_curso(
             detail="No tienes permisos para completar cursos de otro usuario"
         )
     
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
-    curso = db.query(Curso).filter(Curso.id == curso_id).first()
-    if not usuario or not curso:
+    curso = await db.get(Curso, curso_id)
+    if not curso:
         raise HTTPException(status_code=404, detail="Usuario o curso no encontrado")
     
-    # Otorgar CleanPoints por completar el curso
+    # Otorgar CleanPoints por completar el curso (UPDATE atómico). El usuario
+    # autenticado ya está en la sesión y recibe el saldo devuelto por RETURNING.
     cleanpoints_earned = 10
-    usuario.cleanpoints += cleanpoints_earned
-    db.commit()
-    db.refresh(usuario)
-    return usuario
\ No newline at end of file
+    try:
+        await aplicar_puntos(db, usuario_id, cleanpoints_earned, MOTIVO_CURSO, curso_id)
+    except UsuarioNoEncontrado:
+        raise HTTPException(status_code=404, detail="Usuario o curso no encontrado")
+    await db.commit()
+    return current_user
\ No newline at end of file
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, Field
+from datetime import date, datetime
 from typing import Optional
 
 # ===== AUTHENTICATION SCHEMAS =====
@@ -39,6 +39,44 @@ class UsuarioOut(BaseModel):
     class Config:
         orm_mode = True
 
+class PosicionRanking(BaseModel):
+    posicion: int
+    usuario_id: int
+    nombre: str
+    avatar: Optional[str] = None
+    cleanpoints: int
+
+class RankUsuario(BaseModel):
+    usuario_id: int
+    cleanpoints: int
+    posicion: int
+    total_usuarios: int
+
+class CompraDashboard(BaseModel):
+    id: int
+    producto_id: int
+    producto: str
+    precio_pagado: float
+    fecha: datetime
+
+class RecompensaDashboard(BaseModel):
+    id: int
+    nombre: str
+    puntos_requeridos: int
+
+class DashboardUsuario(BaseModel):
+    usuario_id: int
+    nombre: str
+    avatar: Optional[str] = None
+    cleanpoints: int
+    total_recycled_items: int
+    puntos_ganados: int
+    puntos_gastados: int
+    total_compras: int
+    compras_recientes: list[CompraDashboard]
+    total_recompensas: int
+    recompensas: list[RecompensaDashboard]
+
 # ===== COURSE SCHEMAS =====
 class CursoBase(BaseModel):
     titulo: str
@@ -62,6 +100,27 @@ class CursoOut(CursoBase):
     class Config:
         orm_mode = True
 
+class CursoResumen(BaseModel):
+    # Vista de listado: sin `contenido`, que solo devuelve GET /cursos/{id}
+    id: int
+    titulo: str
+    descripcion: Optional[str] = None
+    tema: Optional[str] = None
+    duracion_minutos: Optional[int] = None
+    nivel: Optional[str] = None
+    imagen_url: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+class CursoBusqueda(BaseModel):
+    id: int
+    titulo: str
+    descripcion: Optional[str] = None
+    tema: Optional[str] = None
+    rank: float
+    snippet: Optional[str] = None  # fragmento con los términos entre <mark></mark>
+
 # ===== COURSE PROGRESS SCHEMAS =====
 class CourseProgress(BaseModel):
     course_id: int
@@ -88,6 +147,10 @@ class ProductoBase(BaseModel):
 class ProductoCreate(ProductoBase):
     pass
 
+class CategoriaFacet(BaseModel):
+    categoria: str
+    total: int
+
 class ProductoOut(ProductoBase):
     id: int
     class Config:
@@ -120,6 +183,39 @@ class CompraResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class ItemCarrito(BaseModel):
+    producto_id: int
+    cantidad: int = Field(1, ge=1)
+
+class CarritoCompra(BaseModel):
+    usuario_id: int
+    items: list[ItemCarrito] = Field(..., min_length=1)
+
+class CarritoResponse(BaseModel):
+    compras: list[CompraOut]
+    total_puntos: int
+    new_balance: int
+
+class CotizacionCarrito(BaseModel):
+    usuario_id: int
+    items: list[ItemCarrito] = Field(..., min_length=1)
+
+class LineaCotizacion(BaseModel):
+    producto_id: int
+    nombre: str
+    cantidad: int
+    precio_base: float
+    precio_final: float
+    subtotal: float
+
+class CotizacionCarritoOut(BaseModel):
+    usuario_id: int
+    cleanpoints_usuario: int
+    descuento_aplicado: str
+    items: list[LineaCotizacion]
+    total_base: float
+    total_final: float
+
 # ===== REWARDS SCHEMAS =====
 class RecompensaBase(BaseModel):
     nombre: str
@@ -152,6 +248,15 @@ class QRValidationResponse(BaseModel):
     message: str
     timestamp: datetime
 
+class QRJobOut(BaseModel):
+    job_id: str
+    status: str  # pendiente | procesando | completado | error
+    valid: Optional[bool] = None
+    cleanpoints_earned: int = 0
+    message: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
 # ===== API RESPONSE SCHEMAS =====
 class ApiResponse(BaseModel):
     data: dict
@@ -162,3 +267,17 @@ class ApiError(BaseModel):
     detail: str
     status_code: int
     timestamp: Optional[datetime] = None
+
+# ===== STATS SCHEMAS =====
+class PuntoEstadistica(BaseModel):
+    periodo: datetime
+    validaciones: int
+    cleanpoints: int
+
+class SerieEstadisticas(BaseModel):
+    agrupar: str
+    desde: date
+    hasta: date
+    validaciones: int
+    cleanpoints: int
+    serie: list[PuntoEstadistica]
@@ -1,31 +1,24 @@
-from PIL import Image
-import tensorflow as tf
-import numpy as np
 import os
 
+from services.inference import scheduler, INFERENCE_THRESHOLD
+from services.model_registry import FORMA_ENTRADA
+from services.preprocessing import cargar_para_modelo
+
 async def validate_recycling_image(image_path: str) -> bool:
     """
     Validates if an image shows proper recycling behavior.
-    This is a placeholder implementation - in a real app, you would:
-    1. Use a proper AI model trained on recycling images
-    2. Validate the presence of recycling bins/containers
-    3. Check if the item is being properly disposed
+    The classifier is loaded once at startup by the model registry
+    (services/model_registry.py); this function only preprocesses the image
+    and submits it to the shared batching scheduler.
     """
     try:
-        # Load and preprocess image
-        image = Image.open(image_path)
-        image = image.resize((224, 224))  # Standard input size for many vision models
-        image_array = np.array(image)
-        image_array = image_array / 255.0  # Normalize pixel values
-        
-        # Here you would:
-        # 1. Load your trained model
-        # 2. Predict on the image
-        # 3. Return true if confidence > threshold
-        
-        # For demo purposes, we'll return True 90% of the time
-        return np.random.random() < 0.9
-        
+        # Load and preprocess image, decoding straight to the model input size
+        with open(image_path, "rb") as fp:
+            image_array = cargar_para_modelo(fp, FORMA_ENTRADA[:2])
+
+        score = await scheduler.submit(image_array)
+        return bool(score >= INFERENCE_THRESHOLD)
+
     except Exception as e:
         print(f"Error validating image: {str(e)}")
         return False
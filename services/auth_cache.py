@@ -0,0 +1,108 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+from database import al_modificar_usuarios
+from services import metrics
+
+# Caché de tokens JWT ya verificados -> snapshot del usuario autenticado, para
+# que los clientes que consultan a menudo no paguen la verificación del token
+# ni el SELECT de usuarios en cada request.
+#  - AUTH_CACHE_MAX_ENTRIES: tokens en memoria (LRU)
+#  - AUTH_CACHE_TTL_SECONDS: vigencia máxima de un snapshot (nunca más allá
+#    del `exp` del token)
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+
+hits_counter = metrics.counter("auth_cache_hits_total", "Tokens resueltos por la caché de autenticación")
+misses_counter = metrics.counter("auth_cache_misses_total", "Tokens verificados y buscados en la base de datos")
+
+
+class UsuarioSnapshot(NamedTuple):
+    id: int
+    nombre: str
+    email: str
+    cleanpoints: int
+    total_recycled_items: int
+    fecha_registro: Optional[datetime]
+    avatar: Optional[str]
+
+    @classmethod
+    def desde_usuario(cls, usuario) -> "UsuarioSnapshot":
+        return cls(
+            id=usuario.id,
+            nombre=usuario.nombre,
+            email=usuario.email,
+            cleanpoints=usuario.cleanpoints or 0,
+            total_recycled_items=usuario.total_recycled_items or 0,
+            fecha_registro=usuario.fecha_registro,
+            avatar=usuario.avatar,
+        )
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # token -> (snapshot, vence)
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        # usuario_id -> tokens cacheados, para invalidar por usuario
+        self._por_usuario: Dict[int, Set[str]] = {}
+        # Aumenta en cada invalidación: un snapshot leído antes de una
+        # invalidación concurrente no se guarda
+        self._invalidaciones = 0
+        metrics.gauge("auth_cache_entries", "Tokens en la caché de autenticación", lambda: len(self._entradas))
+
+    def buscar(self, token: str) -> Optional[UsuarioSnapshot]:
+        entrada = self._entradas.get(token)
+        if entrada is not None:
+            if entrada[1] > time.monotonic():
+                self._entradas.move_to_end(token)
+                hits_counter.inc()
+                return entrada[0]
+            self._quitar(token)
+        misses_counter.inc()
+        return None
+
+    def marca(self) -> int:
+        """Tomar antes de leer el usuario de la base de datos y pasarla a `guardar`."""
+        return self._invalidaciones
+
+    def guardar(self, token: str, snapshot: UsuarioSnapshot, exp: Optional[float] = None, marca: Optional[int] = None):
+        """Guarda el snapshot hasta `ttl` segundos o hasta el `exp` (epoch) del token."""
+        if marca is not None and marca != self._invalidaciones:
+            return
+        ttl = self.ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        self._quitar(token)
+        self._entradas[token] = (snapshot, time.monotonic() + ttl)
+        self._por_usuario.setdefault(snapshot.id, set()).add(token)
+        while len(self._entradas) > self.max_entries:
+            self._quitar(next(iter(self._entradas)))
+
+    def invalidar_usuarios(self, usuario_ids: Iterable[int]):
+        self._invalidaciones += 1
+        for usuario_id in usuario_ids:
+            for token in self._por_usuario.pop(usuario_id, ()):
+                self._entradas.pop(token, None)
+
+    def _quitar(self, token: str):
+        entrada = self._entradas.pop(token, None)
+        if entrada is not None:
+            tokens = self._por_usuario.get(entrada[0].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._por_usuario[entrada[0].id]
+
+
+token_cache = TokenCache()
+
+# Cualquier commit que toque una fila de usuarios (PUT /usuarios, movimientos
+# de CleanPoints) descarta los snapshots de ese usuario
+al_modificar_usuarios(token_cache.invalidar_usuarios)
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import BinaryIO, Optional
+
+from PIL import Image
+
+from services import metrics
+from services.preprocessing import MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE
+
+# Almacén local de imágenes direccionado por contenido: cada archivo se guarda
+# con el SHA-256 de sus bytes como nombre, así dos subidas idénticas ocupan un
+# solo archivo y la URL de una imagen nunca cambia de contenido (se puede
+# cachear para siempre).
+#  - BLOB_STORE_DIR: directorio raíz del almacén
+# Estructura:
+#   originales/ab/abcdef...            bytes tal como se subieron
+#   derivados/<tamaño>/ab/abcdef...    JPEG reducido, generado la primera vez
+#                                      que se pide
+# Todas las escrituras van a un temporal del mismo directorio y se publican
+# con os.replace (atómico): un lector nunca ve un archivo a medio escribir.
+# Las fotos de las validaciones QR son de los usuarios y van en un almacén
+# aparte (validaciones/ dentro de BLOB_STORE_DIR) que se sirve con
+# autenticación y sin cachés compartidas.
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "./blobs")
+
+# Lado mayor de cada derivado, en píxeles
+TAMANOS_DERIVADOS = {
+    "thumb": 160,
+    "card": 480,
+}
+CALIDAD_JPEG = 82
+
+_HASH_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+writes_counter = metrics.counter("blob_store_writes_total", "Imágenes nuevas guardadas en el almacén")
+dedup_counter = metrics.counter("blob_store_dedup_total", "Subidas que ya existían en el almacén (mismo SHA-256)")
+derivatives_counter = metrics.counter("blob_store_derivatives_generated_total", "Derivados de imágenes generados")
+
+
+class ArchivoNoEsImagen(ValueError):
+    """El archivo no es una imagen que PIL pueda leer, o supera las dimensiones máximas."""
+
+
+def hash_valido(digest: str) -> bool:
+    return bool(_HASH_VALIDO.match(digest))
+
+
+class BlobStore:
+    def __init__(self, directorio: str = BLOB_STORE_DIR):
+        self.directorio = directorio
+
+    def ruta_original(self, digest: str) -> str:
+        return os.path.join(self.directorio, "originales", digest[:2], digest)
+
+    def ruta_derivado(self, digest: str, tamano: str) -> str:
+        return os.path.join(self.directorio, "derivados", tamano, digest[:2], digest)
+
+    def existe(self, digest: str) -> bool:
+        return hash_valido(digest) and os.path.exists(self.ruta_original(digest))
+
+    def guardar(self, fp: BinaryIO) -> str:
+        """Guarda el contenido de `fp` (desde su posición actual) y devuelve su SHA-256.
+
+        Solo lee la cabecera para validar que sea una imagen; los bytes se
+        copian a disco por bloques mientras se calcula el hash. Lanza
+        `ArchivoNoEsImagen`.
+        """
+        inicio = fp.tell()
+        _validar_imagen(fp)
+        fp.seek(inicio)
+
+        temporal = os.path.join(self.directorio, "tmp")
+        os.makedirs(temporal, exist_ok=True)
+        sha = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=temporal, delete=False) as tmp:
+            try:
+                for bloque in iter(lambda: fp.read(1024 * 1024), b""):
+                    sha.update(bloque)
+                    tmp.write(bloque)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        digest = sha.hexdigest()
+
+        destino = self.ruta_original(digest)
+        if os.path.exists(destino):
+            os.unlink(tmp.name)
+            dedup_counter.inc()
+            return digest
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(tmp.name, destino)
+        writes_counter.inc()
+        return digest
+
+    def derivado(self, digest: str, tamano: str) -> Optional[str]:
+        """Ruta del derivado `tamano` de la imagen, generándolo si aún no existe.
+
+        Devuelve None si la imagen no está en el almacén. Si dos requests
+        generan el mismo derivado a la vez, ambos escriben el mismo resultado
+        y el segundo os.replace simplemente lo reemplaza.
+        """
+        if not self.existe(digest):
+            return None
+        destino = self.ruta_derivado(digest, tamano)
+        if os.path.exists(destino):
+            return destino
+
+        lado = TAMANOS_DERIVADOS[tamano]
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with Image.open(self.ruta_original(digest)) as image:
+            # JPEG: escalar en el dominio DCT antes de decodificar (ver preprocessing.py)
+            image.draft("RGB", (lado, lado))
+            image = image.convert("RGB")
+            image.thumbnail((lado, lado), Image.LANCZOS, reducing_gap=2.0)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(destino), delete=False) as tmp:
+                try:
+                    image.save(tmp, "JPEG", quality=CALIDAD_JPEG, optimize=True, progressive=True)
+                except BaseException:
+                    os.unlink(tmp.name)
+                    raise
+        os.replace(tmp.name, destino)
+        derivatives_counter.inc()
+        return destino
+
+    def tipo_mime(self, digest: str) -> str:
+        """Content-Type del original, según la cabecera del archivo."""
+        with Image.open(self.ruta_original(digest)) as image:
+            return Image.MIME.get(image.format, "application/octet-stream")
+
+
+def _validar_imagen(fp: BinaryIO):
+    try:
+        with Image.open(fp) as image:
+            w, h = image.size
+    except Exception as e:
+        raise ArchivoNoEsImagen(str(e))
+    if w * h > MAX_IMAGE_PIXELS or max(w, h) > MAX_IMAGE_SIDE:
+        raise ArchivoNoEsImagen(f"{w}x{h}")
+
+
+blob_store = BlobStore()
+fotos_validacion = BlobStore(os.path.join(BLOB_STORE_DIR, "validaciones"))
@@ -0,0 +1,46 @@
+import os
+from typing import Dict, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Producto
+
+# Carrito de compras: todos los productos se cargan con un único
+# `SELECT ... WHERE id IN (...)` en vez de una consulta por ítem.
+#  - CARRITO_MAX_UNIDADES: unidades por carrito (cada unidad es una fila en
+#    `compras`), para acotar el tamaño de la transacción
+CARRITO_MAX_UNIDADES = int(os.getenv("CARRITO_MAX_UNIDADES", "100"))
+
+
+class CarritoDemasiadoGrande(Exception):
+    """El carrito supera CARRITO_MAX_UNIDADES unidades."""
+
+
+class ProductosNoEncontrados(Exception):
+    """Algún producto del carrito no existe; `args[0]` son sus ids."""
+
+
+def agrupar_items(items: Iterable) -> Dict[int, int]:
+    """producto_id -> cantidad total, sumando las líneas repetidas.
+
+    Las claves quedan ordenadas por id: reservar el stock siempre en el mismo
+    orden evita que dos carritos se bloqueen mutuamente en la base de datos.
+    """
+    cantidades: Dict[int, int] = {}
+    for item in items:
+        cantidades[item.producto_id] = cantidades.get(item.producto_id, 0) + item.cantidad
+    if sum(cantidades.values()) > CARRITO_MAX_UNIDADES:
+        raise CarritoDemasiadoGrande(CARRITO_MAX_UNIDADES)
+    return dict(sorted(cantidades.items()))
+
+
+async def cargar_productos(db: AsyncSession, producto_ids: Iterable[int]) -> Dict[int, Producto]:
+    """Productos del carrito en una sola consulta. Lanza `ProductosNoEncontrados`."""
+    producto_ids = list(producto_ids)
+    result = await db.scalars(select(Producto).where(Producto.id.in_(producto_ids)))
+    productos = {producto.id: producto for producto in result}
+    faltantes = [producto_id for producto_id in producto_ids if producto_id not in productos]
+    if faltantes:
+        raise ProductosNoEncontrados(faltantes)
+    return productos
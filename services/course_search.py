@@ -0,0 +1,120 @@
+import re
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import IS_SQLITE
+
+# Búsqueda de texto completo sobre cursos con el índice nativo de cada motor:
+#  - SQLite: tabla virtual FTS5 `cursos_fts` con contenido externo (las filas
+#    viven en `cursos`), mantenida por triggers en INSERT/UPDATE/DELETE.
+#  - Postgres: índice GIN sobre una expresión tsvector ponderada; Postgres lo
+#    mantiene solo al escribir en `cursos`.
+# Pesos: el título pesa más que descripción y tema, y estos más que el contenido.
+DICCIONARIO_PG = "spanish"
+MARCA_INICIO = "<mark>"
+MARCA_FIN = "</mark>"
+
+_TSVECTOR_PG = (
+    f"setweight(to_tsvector('{DICCIONARIO_PG}', coalesce(titulo, '')), 'A') || "
+    f"setweight(to_tsvector('{DICCIONARIO_PG}', coalesce(descripcion, '')), 'B') || "
+    f"setweight(to_tsvector('{DICCIONARIO_PG}', coalesce(tema, '')), 'B') || "
+    f"setweight(to_tsvector('{DICCIONARIO_PG}', coalesce(contenido, '')), 'D')"
+)
+
+_DDL_SQLITE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cursos_fts USING fts5(
+        titulo, descripcion, tema, contenido,
+        content='cursos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS cursos_fts_insert AFTER INSERT ON cursos BEGIN
+        INSERT INTO cursos_fts(rowid, titulo, descripcion, tema, contenido)
+        VALUES (new.id, new.titulo, new.descripcion, new.tema, new.contenido);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cursos_fts_delete AFTER DELETE ON cursos BEGIN
+        INSERT INTO cursos_fts(cursos_fts, rowid, titulo, descripcion, tema, contenido)
+        VALUES ('delete', old.id, old.titulo, old.descripcion, old.tema, old.contenido);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cursos_fts_update AFTER UPDATE ON cursos BEGIN
+        INSERT INTO cursos_fts(cursos_fts, rowid, titulo, descripcion, tema, contenido)
+        VALUES ('delete', old.id, old.titulo, old.descripcion, old.tema, old.contenido);
+        INSERT INTO cursos_fts(rowid, titulo, descripcion, tema, contenido)
+        VALUES (new.id, new.titulo, new.descripcion, new.tema, new.contenido);
+    END""",
+]
+
+_BUSCAR_SQLITE = text(f"""
+    SELECT c.id, c.titulo, c.descripcion, c.tema,
+           -bm25(cursos_fts, 10.0, 4.0, 4.0, 1.0) AS rank,
+           snippet(cursos_fts, -1, '{MARCA_INICIO}', '{MARCA_FIN}', '…', 16) AS snippet
+    FROM cursos_fts JOIN cursos c ON c.id = cursos_fts.rowid
+    WHERE cursos_fts MATCH :consulta
+    ORDER BY bm25(cursos_fts, 10.0, 4.0, 4.0, 1.0), c.id
+    LIMIT :limit OFFSET :skip
+""")
+
+# ts_headline es caro: se calcula solo para las filas de la página
+_BUSCAR_PG = text(f"""
+    SELECT p.id, p.titulo, p.descripcion, p.tema, p.rank,
+           ts_headline('{DICCIONARIO_PG}', coalesce(p.contenido, ''), to_tsquery('{DICCIONARIO_PG}', :consulta),
+                       'StartSel={MARCA_INICIO}, StopSel={MARCA_FIN}, MaxFragments=1, MaxWords=20, MinWords=5') AS snippet
+    FROM (
+        SELECT id, titulo, descripcion, tema, contenido,
+               ts_rank_cd({_TSVECTOR_PG}, to_tsquery('{DICCIONARIO_PG}', :consulta)) AS rank
+        FROM cursos
+        WHERE {_TSVECTOR_PG} @@ to_tsquery('{DICCIONARIO_PG}', :consulta)
+        ORDER BY rank DESC, id
+        LIMIT :limit OFFSET :skip
+    ) p
+    ORDER BY p.rank DESC, p.id
+""")
+
+
+def asegurar_indice_busqueda(engine: Engine):
+    """Crea el índice de búsqueda si falta (idempotente).
+
+    En SQLite, si la tabla FTS5 es nueva se indexan los cursos existentes.
+    """
+    with engine.begin() as conn:
+        if IS_SQLITE:
+            existia = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cursos_fts'")
+            ).first()
+            for ddl in _DDL_SQLITE:
+                conn.execute(text(ddl))
+            if not existia:
+                conn.execute(text("INSERT INTO cursos_fts(cursos_fts) VALUES ('rebuild')"))
+        else:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_cursos_busqueda ON cursos USING GIN (({_TSVECTOR_PG}))"))
+
+
+def _terminos(q: str) -> List[str]:
+    return re.findall(r"\w+", q)
+
+
+def consulta_fts(q: str) -> str:
+    """Convierte el texto del usuario en una consulta segura para el motor.
+
+    Todos los términos son obligatorios y el último se busca como prefijo,
+    para que la búsqueda funcione mientras se escribe.
+    """
+    terminos = _terminos(q)
+    if IS_SQLITE:
+        partes = [f'"{t}"' for t in terminos]
+        partes[-1] += "*"
+        return " ".join(partes)
+    partes = list(terminos)
+    partes[-1] += ":*"
+    return " & ".join(partes)
+
+
+async def buscar_cursos(db: AsyncSession, q: str, limit: int, skip: int = 0) -> list:
+    """Cursos que contienen los términos de `q`, del más al menos relevante."""
+    if not _terminos(q):
+        return []
+    query = _BUSCAR_SQLITE if IS_SQLITE else _BUSCAR_PG
+    result = await db.execute(query, {"consulta": consulta_fts(q), "limit": limit, "skip": skip})
+    return [dict(row) for row in result.mappings()]
@@ -0,0 +1,177 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import IS_SQLITE, al_modificar_usuarios
+from services import metrics
+
+# Panel del perfil (GET /usuarios/{id}/dashboard): saldo, items reciclados,
+# totales ganados/gastados, compras recientes y recompensas en una sola
+# consulta. Las listas se arman en la base con las funciones JSON de cada
+# motor y los totales salen de un único GROUP BY sobre movimientos_puntos
+# (índice usuario + fecha).
+#  - DASHBOARD_CACHE_TTL_SECONDS: vigencia del panel cacheado por usuario
+#  - DASHBOARD_CACHE_MAX_ENTRIES: paneles en memoria (LRU) y usuarios cuya
+#    última invalidación se recuerda
+# Cualquier commit que toque al usuario (puntos, compras, recompensas,
+# PUT /usuarios) descarta su panel; el TTL solo acota lo que tarda en verse
+# un cambio hecho por otro worker.
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "5"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "10000"))
+# Elementos de cada lista del panel
+DASHBOARD_ITEMS = 5
+
+hits_counter = metrics.counter("dashboard_cache_hits_total", "Paneles de usuario servidos desde la caché")
+misses_counter = metrics.counter("dashboard_cache_misses_total", "Paneles de usuario consultados en la base de datos")
+
+_DASHBOARD_SQLITE = text("""
+    SELECT u.id AS usuario_id, u.nombre, u.avatar,
+           coalesce(u.cleanpoints, 0) AS cleanpoints,
+           coalesce(u.total_recycled_items, 0) AS total_recycled_items,
+           coalesce(m.ganados, 0) AS puntos_ganados,
+           coalesce(m.gastados, 0) AS puntos_gastados,
+           (SELECT count(*) FROM compras WHERE usuario_id = :usuario_id) AS total_compras,
+           (SELECT json_group_array(json_object(
+                       'id', c.id, 'producto_id', c.producto_id, 'producto', p.nombre,
+                       'precio_pagado', c.precio_pagado, 'fecha', c.fecha))
+            FROM (SELECT id, producto_id, precio_pagado, fecha FROM compras
+                  WHERE usuario_id = :usuario_id
+                  ORDER BY fecha DESC, id DESC LIMIT :items) c
+            JOIN productos p ON p.id = c.producto_id) AS compras_recientes,
+           (SELECT count(*) FROM recompensas WHERE usuario_id = :usuario_id) AS total_recompensas,
+           (SELECT json_group_array(json_object(
+                       'id', r.id, 'nombre', r.nombre, 'puntos_requeridos', r.puntos_requeridos))
+            FROM (SELECT id, nombre, puntos_requeridos FROM recompensas
+                  WHERE usuario_id = :usuario_id
+                  ORDER BY id DESC LIMIT :items) r) AS recompensas
+    FROM usuarios u
+    LEFT JOIN (
+        SELECT usuario_id,
+               sum(CASE WHEN delta > 0 THEN delta ELSE 0 END) AS ganados,
+               sum(CASE WHEN delta < 0 THEN -delta ELSE 0 END) AS gastados
+        FROM movimientos_puntos
+        WHERE usuario_id = :usuario_id
+        GROUP BY usuario_id
+    ) m ON m.usuario_id = u.id
+    WHERE u.id = :usuario_id
+""")
+
+_DASHBOARD_PG = text("""
+    SELECT u.id AS usuario_id, u.nombre, u.avatar,
+           coalesce(u.cleanpoints, 0) AS cleanpoints,
+           coalesce(u.total_recycled_items, 0) AS total_recycled_items,
+           coalesce(m.ganados, 0) AS puntos_ganados,
+           coalesce(m.gastados, 0) AS puntos_gastados,
+           (SELECT count(*) FROM compras WHERE usuario_id = :usuario_id) AS total_compras,
+           (SELECT coalesce(json_agg(json_build_object(
+                       'id', c.id, 'producto_id', c.producto_id, 'producto', p.nombre,
+                       'precio_pagado', c.precio_pagado, 'fecha', c.fecha)
+                   ORDER BY c.fecha DESC, c.id DESC), '[]'::json)
+            FROM (SELECT id, producto_id, precio_pagado, fecha FROM compras
+                  WHERE usuario_id = :usuario_id
+                  ORDER BY fecha DESC, id DESC LIMIT :items) c
+            JOIN productos p ON p.id = c.producto_id) AS compras_recientes,
+           (SELECT count(*) FROM recompensas WHERE usuario_id = :usuario_id) AS total_recompensas,
+           (SELECT coalesce(json_agg(json_build_object(
+                       'id', r.id, 'nombre', r.nombre, 'puntos_requeridos', r.puntos_requeridos)
+                   ORDER BY r.id DESC), '[]'::json)
+            FROM (SELECT id, nombre, puntos_requeridos FROM recompensas
+                  WHERE usuario_id = :usuario_id
+                  ORDER BY id DESC LIMIT :items) r) AS recompensas
+    FROM usuarios u
+    LEFT JOIN (
+        SELECT usuario_id,
+               sum(CASE WHEN delta > 0 THEN delta ELSE 0 END) AS ganados,
+               sum(CASE WHEN delta < 0 THEN -delta ELSE 0 END) AS gastados
+        FROM movimientos_puntos
+        WHERE usuario_id = :usuario_id
+        GROUP BY usuario_id
+    ) m ON m.usuario_id = u.id
+    WHERE u.id = :usuario_id
+""")
+
+
+def _lista(valor) -> list:
+    # aiosqlite devuelve el JSON como texto; asyncpg puede devolverlo ya decodificado
+    if valor is None:
+        return []
+    return json.loads(valor) if isinstance(valor, str) else valor
+
+
+async def consultar_dashboard(db: AsyncSession, usuario_id: int) -> Optional[dict]:
+    """Panel del usuario en una sola consulta, o None si no existe."""
+    query = _DASHBOARD_SQLITE if IS_SQLITE else _DASHBOARD_PG
+    result = await db.execute(query, {"usuario_id": usuario_id, "items": DASHBOARD_ITEMS})
+    fila = result.mappings().first()
+    if fila is None:
+        return None
+    panel = dict(fila)
+    # El JOIN con productos no garantiza el orden en SQLite: reordenar aquí
+    panel["compras_recientes"] = sorted(
+        _lista(panel["compras_recientes"]), key=lambda c: (c["fecha"], c["id"]), reverse=True
+    )
+    panel["recompensas"] = _lista(panel["recompensas"])
+    return panel
+
+
+class DashboardCache:
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL_SECONDS, max_entries: int = DASHBOARD_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # usuario_id -> (panel, vence)
+        self._entradas: "OrderedDict[int, tuple]" = OrderedDict()
+        # Un panel leído antes de una invalidación concurrente del mismo
+        # usuario no se guarda. Cada invalidación toma un número de una
+        # secuencia global; se recuerda la última por usuario en un LRU de
+        # `max_entries` usuarios. Al descartar uno, `_piso` sube a su número:
+        # un panel cuya marca sea anterior ya no se puede comprobar y
+        # tampoco se guarda.
+        self._secuencia = 0
+        self._versiones: "OrderedDict[int, int]" = OrderedDict()
+        self._piso = 0
+        metrics.gauge("dashboard_cache_entries", "Paneles de usuario en la caché", lambda: len(self._entradas))
+
+    def buscar(self, usuario_id: int) -> Optional[dict]:
+        entrada = self._entradas.get(usuario_id)
+        if entrada is not None:
+            if entrada[1] > time.monotonic():
+                self._entradas.move_to_end(usuario_id)
+                hits_counter.inc()
+                return entrada[0]
+            del self._entradas[usuario_id]
+        misses_counter.inc()
+        return None
+
+    def marca(self) -> int:
+        """Tomar antes de consultar el panel y pasarla a `guardar`."""
+        return self._secuencia
+
+    def guardar(self, usuario_id: int, panel: dict, marca: int):
+        if self.ttl <= 0 or marca < self._piso or self._versiones.get(usuario_id, 0) > marca:
+            return
+        self._entradas[usuario_id] = (panel, time.monotonic() + self.ttl)
+        self._entradas.move_to_end(usuario_id)
+        while len(self._entradas) > self.max_entries:
+            self._entradas.popitem(last=False)
+
+    def invalidar_usuarios(self, usuario_ids: Iterable[int]):
+        for usuario_id in usuario_ids:
+            self._entradas.pop(usuario_id, None)
+            self._secuencia += 1
+            self._versiones[usuario_id] = self._secuencia
+            self._versiones.move_to_end(usuario_id)
+        while len(self._versiones) > self.max_entries:
+            _, secuencia = self._versiones.popitem(last=False)
+            self._piso = max(self._piso, secuencia)
+
+
+dashboard_cache = DashboardCache()
+
+# Movimientos de CleanPoints, compras, recompensas y PUT /usuarios marcan al
+# usuario; al confirmar se descarta su panel
+al_modificar_usuarios(dashboard_cache.invalidar_usuarios)
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Optional, Set
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import HuellaImagen
+from services import metrics
+from services.preprocessing import validar_dimensiones
+
+# Caché de veredictos por hash perceptual (dHash): una foto reenviada, o casi
+# idéntica, recibe el veredicto ya calculado sin decodificarla a resolución
+# completa ni pasar por el modelo.
+#  - IMAGE_CACHE_MAX_ENTRIES: huellas en memoria (LRU)
+#  - IMAGE_CACHE_TTL_SECONDS: vigencia de cada veredicto
+#  - IMAGE_CACHE_MAX_DISTANCE: distancia de Hamming máxima para considerar
+#    dos fotos la misma (0-7)
+#  - IMAGE_CACHE_PERSIST: 1 para guardar las huellas en la tabla
+#    huellas_imagenes y recargarlas al arrancar
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "10000"))
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(24 * 3600)))
+IMAGE_CACHE_MAX_DISTANCE = min(int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "5")), 7)
+IMAGE_CACHE_PERSIST = os.getenv("IMAGE_CACHE_PERSIST", "0") == "1"
+
+# El hash de 64 bits se indexa en 8 bandas de 8 bits: si dos hashes difieren
+# en 7 bits o menos, al menos una banda es idéntica (principio del palomar).
+_BANDAS = 8
+_BITS_BANDA = 64 // _BANDAS
+_MASCARA_BANDA = (1 << _BITS_BANDA) - 1
+_SIN_DETALLE = (0, (1 << 64) - 1)
+
+hits_counter = metrics.counter("image_cache_hits_total", "Validaciones resueltas por la caché de hashes perceptuales")
+misses_counter = metrics.counter("image_cache_misses_total", "Validaciones que no encontraron una foto similar en la caché")
+
+
+def dhash(fp: BinaryIO) -> int:
+    """Hash de diferencias (dHash) de 64 bits.
+
+    Con `draft()` el JPEG se decodifica a 1/8 de su tamaño, así calcular el
+    hash cuesta una fracción de la decodificación completa. Los demás
+    formatos se decodifican enteros, por eso las dimensiones se validan antes
+    (lanza ImagenDemasiadoGrande).
+    """
+    with Image.open(fp) as image:
+        validar_dimensiones(image)
+        image.draft("L", (64, 64))
+        pequena = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pequena[:, 1:] > pequena[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _bandas(huella: int):
+    return [(i, (huella >> (i * _BITS_BANDA)) & _MASCARA_BANDA) for i in range(_BANDAS)]
+
+
+class PerceptualCache:
+    def __init__(
+        self,
+        max_entries: int = IMAGE_CACHE_MAX_ENTRIES,
+        ttl: float = IMAGE_CACHE_TTL_SECONDS,
+        max_distance: int = IMAGE_CACHE_MAX_DISTANCE,
+        persist: bool = IMAGE_CACHE_PERSIST,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.persist = persist
+        # huella -> (veredicto, vence)
+        self._entradas: "OrderedDict[int, tuple]" = OrderedDict()
+        self._indice: Dict[tuple, Set[int]] = {}
+        self._tareas: Set[asyncio.Task] = set()
+        metrics.gauge("image_cache_hit_ratio", "Proporción de aciertos de la caché de hashes perceptuales", self.hit_ratio)
+        metrics.gauge("image_cache_entries", "Huellas en la caché de hashes perceptuales", lambda: len(self._entradas))
+
+    @staticmethod
+    def hit_ratio() -> float:
+        total = hits_counter.value + misses_counter.value
+        return hits_counter.value / total if total else 0.0
+
+    def buscar(self, huella: int) -> Optional[bool]:
+        """Veredicto de la foto más parecida dentro de `max_distance`, si la hay."""
+        if huella in _SIN_DETALLE:
+            # Imágenes planas: todas comparten hash, no se pueden distinguir
+            return None
+        ahora = time.monotonic()
+        candidatas = set()
+        for banda in _bandas(huella):
+            candidatas |= self._indice.get(banda, set())
+        mejor, mejor_distancia = None, self.max_distance + 1
+        for candidata in candidatas:
+            if self._entradas[candidata][1] <= ahora:
+                self._quitar(candidata)
+                continue
+            distancia = (candidata ^ huella).bit_count()
+            if distancia < mejor_distancia:
+                mejor, mejor_distancia = candidata, distancia
+        if mejor is None:
+            misses_counter.inc()
+            return None
+        self._entradas.move_to_end(mejor)
+        hits_counter.inc()
+        return self._entradas[mejor][0]
+
+    def guardar(self, huella: int, veredicto: bool, persistir: bool = True):
+        if huella in _SIN_DETALLE:
+            return
+        if huella in self._entradas:
+            self._quitar(huella)
+        self._entradas[huella] = (veredicto, time.monotonic() + self.ttl)
+        for banda in _bandas(huella):
+            self._indice.setdefault(banda, set()).add(huella)
+        while len(self._entradas) > self.max_entries:
+            self._quitar(next(iter(self._entradas)))
+        if self.persist and persistir:
+            tarea = asyncio.create_task(self._persistir(huella, veredicto))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+
+    def _quitar(self, huella: int):
+        self._entradas.pop(huella, None)
+        for banda in _bandas(huella):
+            grupo = self._indice.get(banda)
+            if grupo is not None:
+                grupo.discard(huella)
+                if not grupo:
+                    del self._indice[banda]
+
+    async def _persistir(self, huella: int, veredicto: bool):
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add(HuellaImagen(huella=f"{huella:016x}", valido=veredicto))
+                await db.commit()
+        except Exception as e:
+            print(f"Error guardando huella de imagen: {e}")
+
+    async def cargar_persistidas(self):
+        """Recarga en memoria las huellas vigentes de la tabla huellas_imagenes."""
+        if not self.persist:
+            return
+        desde = datetime.utcnow() - timedelta(seconds=self.ttl)
+        async with AsyncSessionLocal() as db:
+            filas = await db.execute(
+                select(HuellaImagen.huella, HuellaImagen.valido)
+                .where(HuellaImagen.fecha >= desde)
+                .order_by(HuellaImagen.fecha.desc())
+                .limit(self.max_entries)
+            )
+            # De la más antigua a la más reciente para respetar el orden LRU
+            for huella, valido in reversed(filas.all()):
+                self.guardar(int(huella, 16), valido, persistir=False)
+
+
+image_cache = PerceptualCache()
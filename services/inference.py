@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from services import metrics
+from services.model_registry import registry
+
+# Planificador de inferencia por micro-lotes: los requests encolan su tensor ya
+# preprocesado y un worker agrupa hasta INFERENCE_MAX_BATCH imágenes (o espera
+# como mucho INFERENCE_MAX_WAIT_MS) para ejecutar el modelo una sola vez.
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", "256"))
+# Puntuación mínima para considerar válida una imagen de reciclaje
+INFERENCE_THRESHOLD = float(os.getenv("INFERENCE_THRESHOLD", "0.5"))
+
+batch_size_histogram = metrics.histogram(
+    "inference_batch_size",
+    "Imágenes por lote ejecutado por el modelo",
+    [1, 2, 4, 8, 16, 32, 64, 128],
+)
+queue_wait_histogram = metrics.histogram(
+    "inference_queue_wait_seconds",
+    "Tiempo que una imagen espera en la cola antes de entrar a un lote",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+rejected_counter = metrics.counter(
+    "inference_rejected_total",
+    "Imágenes rechazadas por tener la cola de inferencia llena",
+)
+
+
+class ColaInferenciaLlena(Exception):
+    """La cola de inferencia alcanzó INFERENCE_QUEUE_DEPTH."""
+
+
+# Recibe un lote (N, alto, ancho, canales) y devuelve N puntuaciones en [0, 1]
+PredictBatch = Callable[[np.ndarray], np.ndarray]
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        predict_batch: PredictBatch,
+        max_batch_size: int = INFERENCE_MAX_BATCH,
+        max_wait_ms: float = INFERENCE_MAX_WAIT_MS,
+        max_queue: int = INFERENCE_QUEUE_DEPTH,
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._lleno: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._lleno = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            pendientes = []
+            while not self._queue.empty():
+                pendientes.append(self._queue.get_nowait())
+            _fallar(pendientes, RuntimeError("Planificador de inferencia detenido"))
+
+    async def submit(self, tensor: np.ndarray) -> float:
+        """Encola un tensor preprocesado y espera su puntuación."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((tensor, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            rejected_counter.inc()
+            raise ColaInferenciaLlena()
+        if self._queue.qsize() >= self.max_batch_size - 1:
+            self._lleno.set()
+        return await future
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        if self._queue.qsize() < self.max_batch_size - 1:
+            # Esperar a que se complete el lote o venza el plazo, lo que ocurra primero
+            self._lleno.clear()
+            try:
+                await asyncio.wait_for(self._lleno.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            inicio = time.perf_counter()
+            for _, _, encolado in batch:
+                queue_wait_histogram.observe(inicio - encolado)
+            batch_size_histogram.observe(len(batch))
+            try:
+                stacked = np.stack([tensor for tensor, _, _ in batch])
+                # El modelo es trabajo de CPU: ejecutarlo fuera del event loop
+                scores = await loop.run_in_executor(None, self.predict_batch, stacked)
+            except asyncio.CancelledError:
+                _fallar(batch, RuntimeError("Planificador de inferencia detenido"))
+                raise
+            except Exception as e:
+                _fallar(batch, e)
+                continue
+            for (_, future, _), score in zip(batch, scores):
+                # El request pudo cancelarse (cliente desconectado) mientras esperaba
+                if not future.done():
+                    future.set_result(float(score))
+
+
+def _fallar(batch, error: Exception):
+    for _, future, _ in batch:
+        if not future.done():
+            future.set_exception(error)
+
+
+# El modelo se resuelve en cada lote a través del registro, que permite
+# reemplazarlo en caliente (ver services/model_registry.py)
+scheduler = BatchScheduler(registry.predict_batch)
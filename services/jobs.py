@@ -0,0 +1,117 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from services import metrics
+
+# Pool de workers en proceso para los trabajos de validación asíncrona: el
+# endpoint persiste el trabajo, encola su id y responde 202; los workers lo
+# procesan y despiertan a quien esté esperando el resultado (long-poll).
+#  - QR_JOB_WORKERS: trabajos procesados en paralelo
+#  - QR_JOB_LEASE_SECONDS: vigencia del reclamo de un trabajo. Un proceso
+#    reclama el trabajo con su WORKER_ID y lo renueva mientras espera al
+#    validador; otro proceso solo lo retoma cuando el reclamo vence (su dueño
+#    murió o se reinició). También es el intervalo con el que cada proceso
+#    busca trabajos pendientes o con el reclamo vencido.
+# Con varios workers de uvicorn cada proceso tiene su propio pool: el
+# trabajo lo procesa quien lo reclame primero.
+QR_JOB_WORKERS = int(os.getenv("QR_JOB_WORKERS", "4"))
+QR_JOB_LEASE_SECONDS = float(os.getenv("QR_JOB_LEASE_SECONDS", "60"))
+
+# Identifica a este proceso en `trabajos_validacion.worker_id`
+WORKER_ID = f"{socket.gethostname()[:40]}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+completed_counter = metrics.counter("qr_jobs_completed_total", "Trabajos de validación terminados con resultado")
+failed_counter = metrics.counter("qr_jobs_failed_total", "Trabajos de validación terminados con error")
+lost_counter = metrics.counter("qr_jobs_lease_lost_total", "Trabajos abandonados porque otro proceso los retomó")
+
+
+class TrabajoPerdido(Exception):
+    """El reclamo del trabajo venció y otro proceso lo retomó."""
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        procesar: Callable[[str], Awaitable[None]],
+        workers: int = QR_JOB_WORKERS,
+        buscar: Optional[Callable[[], Awaitable[Iterable[str]]]] = None,
+        intervalo: float = QR_JOB_LEASE_SECONDS,
+    ):
+        self.procesar = procesar
+        self.workers = workers
+        # `buscar` devuelve los trabajos que este proceso puede reclamar; se
+        # consulta cada `intervalo` segundos
+        self.buscar = buscar
+        self.intervalo = intervalo
+        self._queue: Optional[asyncio.Queue] = None
+        self._encolados: Set[str] = set()
+        self._tareas: List[asyncio.Task] = []
+        # id del trabajo -> (evento, número de clientes esperando)
+        self._esperas: Dict[str, list] = {}
+        metrics.gauge("qr_jobs_queued", "Trabajos de validación en cola", lambda: self._queue.qsize() if self._queue else 0)
+
+    def start(self, pendientes: Iterable[str] = ()):
+        """Arranca los workers y encola los trabajos que quedaron sin terminar."""
+        if not self._tareas:
+            self._queue = asyncio.Queue()
+            self._tareas = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+            if self.buscar is not None and self.intervalo > 0:
+                self._tareas.append(asyncio.create_task(self._barrer()))
+        for job_id in pendientes:
+            self.encolar(job_id)
+
+    async def stop(self):
+        # Los trabajos en cola siguen persistidos y se recuperan al arrancar
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        self._encolados.clear()
+
+    def encolar(self, job_id: str):
+        if job_id not in self._encolados:
+            self._encolados.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def notificar(self, job_id: str):
+        """Despierta a los clientes que esperan el resultado de `job_id`."""
+        espera = self._esperas.pop(job_id, None)
+        if espera is not None:
+            espera[0].set()
+
+    def suscribir(self, job_id: str) -> asyncio.Event:
+        espera = self._esperas.setdefault(job_id, [asyncio.Event(), 0])
+        espera[1] += 1
+        return espera[0]
+
+    def desuscribir(self, job_id: str):
+        espera = self._esperas.get(job_id)
+        if espera is not None:
+            espera[1] -= 1
+            if espera[1] <= 0:
+                del self._esperas[job_id]
+
+    async def _run(self):
+        while True:
+            job_id = await self._queue.get()
+            self._encolados.discard(job_id)
+            try:
+                await self.procesar(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error procesando trabajo {job_id}: {e}")
+            finally:
+                self.notificar(job_id)
+
+    async def _barrer(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                for job_id in await self.buscar():
+                    self.encolar(job_id)
+            except Exception as e:
+                print(f"Error buscando trabajos de validación: {e}")
@@ -0,0 +1,133 @@
+import asyncio
+import bisect
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, al_modificar_usuarios
+from models import Usuario
+from services import metrics
+
+# Ranking de usuarios por CleanPoints en memoria: un arreglo ordenado de
+# claves (-cleanpoints, usuario_id) donde las búsquedas son con bisect
+# (O(log n)). Se construye desde la base al arrancar y cada commit que mueve
+# puntos lo actualiza con el saldo devuelto por RETURNING (ver
+# `al_modificar_usuarios` en database.py), así el top-N y la posición de un
+# usuario no consultan la base.
+#  - LEADERBOARD_RESYNC_SECONDS: cada cuánto se reconstruye desde la base. Con
+#    varios workers de uvicorn cada proceso solo ve sus propios commits; la
+#    reconstrucción periódica incorpora los de los demás (0 = nunca)
+# Los empates comparten posición (1, 2, 2, 4...) y se listan por id.
+LEADERBOARD_RESYNC_SECONDS = float(os.getenv("LEADERBOARD_RESYNC_SECONDS", "300"))
+
+rebuild_histogram = metrics.histogram(
+    "leaderboard_rebuild_seconds",
+    "Duración de la reconstrucción del ranking desde la base de datos",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0),
+)
+
+
+class Posicion(NamedTuple):
+    posicion: int
+    usuario_id: int
+    cleanpoints: int
+
+
+class Leaderboard:
+    def __init__(self, resync_seconds: float = LEADERBOARD_RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self._claves: List[Tuple[int, int]] = []
+        self._puntos: Dict[int, int] = {}
+        # Saldos recibidos mientras se reconstruye: se reaplican sobre la
+        # foto de la base, que puede haberse leído antes de esos commits
+        self._durante_reconstruccion: Optional[Dict[int, int]] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self.listo = False
+        metrics.gauge("leaderboard_users", "Usuarios en el ranking en memoria", lambda: len(self._claves))
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    def actualizar(self, usuario_id: int, cleanpoints: int):
+        if self._durante_reconstruccion is not None:
+            self._durante_reconstruccion[usuario_id] = cleanpoints
+        self._poner(usuario_id, cleanpoints)
+
+    def al_modificar(self, cambios: Dict[int, Optional[int]]):
+        """Oyente de commits sobre `usuarios`; ignora los cambios sin saldo."""
+        for usuario_id, cleanpoints in cambios.items():
+            if cleanpoints is not None:
+                self.actualizar(usuario_id, cleanpoints)
+
+    def _poner(self, usuario_id: int, cleanpoints: int):
+        anterior = self._puntos.get(usuario_id)
+        if anterior == cleanpoints:
+            return
+        if anterior is not None:
+            del self._claves[bisect.bisect_left(self._claves, (-anterior, usuario_id))]
+        bisect.insort(self._claves, (-cleanpoints, usuario_id))
+        self._puntos[usuario_id] = cleanpoints
+
+    def _posicion_de(self, cleanpoints: int) -> int:
+        # 1 + usuarios con más puntos; (-p,) ordena antes que cualquier (-p, id)
+        return bisect.bisect_left(self._claves, (-cleanpoints,)) + 1
+
+    def top(self, limit: int, skip: int = 0) -> List[Posicion]:
+        return [
+            Posicion(self._posicion_de(-clave), usuario_id, -clave)
+            for clave, usuario_id in self._claves[skip:skip + limit]
+        ]
+
+    def posicion(self, usuario_id: int) -> Optional[Posicion]:
+        cleanpoints = self._puntos.get(usuario_id)
+        if cleanpoints is None:
+            return None
+        return Posicion(self._posicion_de(cleanpoints), usuario_id, cleanpoints)
+
+    async def reconstruir(self):
+        """Carga todos los saldos desde la base y reemplaza el ranking."""
+        inicio = time.perf_counter()
+        self._durante_reconstruccion = {}
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.stream(
+                    select(Usuario.id, Usuario.cleanpoints).order_by(Usuario.cleanpoints.desc())
+                )
+                puntos = {usuario_id: cleanpoints or 0 async for usuario_id, cleanpoints in result}
+            # Las filas llegan casi ordenadas (índice ix_usuarios_cleanpoints):
+            # ordenar solo resuelve los empates por id
+            claves = sorted((-cleanpoints, usuario_id) for usuario_id, cleanpoints in puntos.items())
+            recibidos = self._durante_reconstruccion
+            self._claves, self._puntos = claves, puntos
+            for usuario_id, cleanpoints in recibidos.items():
+                self._poner(usuario_id, cleanpoints)
+        finally:
+            self._durante_reconstruccion = None
+        self.listo = True
+        rebuild_histogram.observe(time.perf_counter() - inicio)
+
+    def start(self):
+        if self._tarea is None and self.resync_seconds > 0:
+            self._tarea = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resync_seconds)
+            try:
+                await self.reconstruir()
+            except Exception as e:
+                print(f"Error reconstruyendo el ranking: {e}")
+
+
+leaderboard = Leaderboard()
+
+# Cada commit que mueve CleanPoints (o crea un usuario) actualiza el ranking
+al_modificar_usuarios(leaderboard.al_modificar)
@@ -0,0 +1,103 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Sequence, Union
+
+# Métricas en memoria del proceso, expuestas en formato Prometheus por GET /metrics.
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Gauge:
+    """Valor instantáneo; `fn` permite leerlo en el momento de exportar."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._fn = fn
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> List[str]:
+        value = self._fn() if self._fn is not None else self.value
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {value}",
+        ]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.counts):
+                self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        acumulado = 0
+        for limite, n in zip(self.buckets, self.counts):
+            acumulado += n
+            lines.append(f'{self.name}_bucket{{le="{limite}"}} {acumulado}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+Metric = Union[Counter, Gauge, Histogram]
+_registry: Dict[str, Metric] = {}
+
+
+def _register(metric: Metric) -> Metric:
+    # Reusar la métrica si el módulo que la define se importa más de una vez
+    return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help))
+
+
+def gauge(name: str, help: str, fn: Callable[[], float] = None) -> Gauge:
+    return _register(Gauge(name, help, fn))
+
+
+def histogram(name: str, help: str, buckets: Sequence[float]) -> Histogram:
+    return _register(Histogram(name, help, buckets))
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
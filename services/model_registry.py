@@ -0,0 +1,144 @@
+import asyncio
+import os
+from typing import Optional
+
+import numpy as np
+
+# Registro del clasificador de imágenes de reciclaje: el modelo se carga una
+# sola vez al arrancar la aplicación (lifespan), se calienta con entradas
+# sintéticas y se comparte entre todos los requests. Se puede reemplazar en
+# caliente sin cortar las inferencias en curso.
+#  - MODEL_PATH: pesos del modelo (.npz para el modelo NumPy, .keras/.h5 para
+#    TensorFlow). Si no se define se usa el modelo simulado.
+#  - MODEL_WARMUP_RUNS: inferencias de calentamiento por tamaño de lote.
+#  - MODEL_RELOAD_TOKEN: token de operaciones que exige POST
+#    /qr/modelo/recargar (cabecera X-Model-Reload-Token). Vacío = endpoint
+#    deshabilitado.
+#  - MODELS_DIR: directorio desde el que la recarga puede tomar otra versión
+#    del modelo por nombre de archivo. Vacío = solo se recarga MODEL_PATH.
+MODEL_PATH = os.getenv("MODEL_PATH", "").strip()
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+MODEL_RELOAD_TOKEN = os.getenv("MODEL_RELOAD_TOKEN", "").strip()
+MODELS_DIR = os.getenv("MODELS_DIR", "").strip()
+FORMA_ENTRADA = (224, 224, 3)
+
+
+class ModeloNoDisponible(Exception):
+    """Todavía no hay un modelo cargado y calentado."""
+
+
+class RutaModeloInvalida(ValueError):
+    """El modelo pedido no es un archivo dentro de MODELS_DIR."""
+
+
+def resolver_ruta_modelo(nombre: str, directorio: str = MODELS_DIR) -> str:
+    """Ruta del modelo `nombre` dentro de `directorio`, sin permitir salir de él."""
+    if not directorio:
+        raise RutaModeloInvalida("MODELS_DIR no está configurado")
+    raiz = os.path.realpath(directorio)
+    ruta = os.path.realpath(os.path.join(raiz, nombre))
+    if os.path.dirname(ruta) != raiz or not os.path.isfile(ruta):
+        raise RutaModeloInvalida(nombre)
+    return ruta
+
+
+class ModeloSimulado:
+    """Modelo de relleno: simula que el 80% de las imágenes son reciclaje válido."""
+
+    version = "simulado"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.where(np.random.random(len(batch)) < 0.8, 0.9, 0.1).astype(np.float32)
+
+
+class ModeloNumpy:
+    """Clasificador lineal mínimo implementado solo con NumPy.
+
+    Extrae la media y la desviación estándar de cada canal y aplica una
+    regresión logística. El archivo .npz debe contener `pesos` (6,) y `sesgo`
+    y, opcionalmente, `version`.
+    """
+
+    def __init__(self, pesos: np.ndarray, sesgo: float, version: str = "numpy"):
+        self.pesos = np.asarray(pesos, dtype=np.float32)
+        self.sesgo = np.float32(sesgo)
+        self.version = version
+
+    @classmethod
+    def desde_archivo(cls, ruta: str) -> "ModeloNumpy":
+        with np.load(ruta) as datos:
+            version = str(datos["version"]) if "version" in datos else os.path.basename(ruta)
+            return cls(datos["pesos"], float(datos["sesgo"]), version)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        caracteristicas = np.concatenate([batch.mean(axis=(1, 2)), batch.std(axis=(1, 2))], axis=1)
+        logits = caracteristicas @ self.pesos + self.sesgo
+        return 1.0 / (1.0 + np.exp(-logits))
+
+
+class ModeloKeras:
+    """Adaptador para un modelo de TensorFlow/Keras (dependencia opcional)."""
+
+    def __init__(self, ruta: str):
+        import tensorflow as tf
+
+        self._modelo = tf.keras.models.load_model(ruta)
+        self.version = os.path.basename(ruta)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self._modelo.predict(batch, verbose=0)).reshape(len(batch))
+
+
+def cargar_modelo(ruta: str = ""):
+    if not ruta:
+        return ModeloSimulado()
+    if ruta.endswith(".npz"):
+        return ModeloNumpy.desde_archivo(ruta)
+    if ruta.endswith((".keras", ".h5")):
+        return ModeloKeras(ruta)
+    raise ValueError(f"Formato de modelo no soportado: {ruta}")
+
+
+def calentar(modelo, tamanos_lote=(1,), runs: int = MODEL_WARMUP_RUNS):
+    """Ejecuta inferencias sobre entradas sintéticas para inicializar el modelo."""
+    for tamano in tamanos_lote:
+        entrada = np.random.random((tamano, *FORMA_ENTRADA)).astype(np.float32)
+        for _ in range(runs):
+            modelo.predict(entrada)
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._actual = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def listo(self) -> bool:
+        return self._actual is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._actual.version if self._actual is not None else None
+
+    async def cargar(self, ruta: str = MODEL_PATH, tamanos_lote=(1,)) -> str:
+        """Carga y calienta un modelo y luego lo publica.
+
+        Mientras se prepara el nuevo modelo el anterior sigue atendiendo; el
+        cambio es un simple reemplazo de referencia, así que los lotes en curso
+        terminan con el modelo con el que empezaron.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            modelo = await loop.run_in_executor(None, cargar_modelo, ruta)
+            await loop.run_in_executor(None, calentar, modelo, tamanos_lote)
+            self._actual = modelo
+            return modelo.version
+
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        modelo = self._actual
+        if modelo is None:
+            raise ModeloNoDisponible()
+        return modelo.predict(batch)
+
+
+registry = ModelRegistry()
@@ -0,0 +1,113 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import DateTime, Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Paginación por cursor (keyset): en lugar de OFFSET, que obliga a la base de
+# datos a recorrer y descartar `skip` filas, cada página continúa después de
+# la clave de la última fila devuelta. El cursor es opaco para el cliente y
+# viaja en la cabecera X-Next-Cursor; el cuerpo de la respuesta sigue siendo
+# una lista, así los clientes que usan `skip` no cambian.
+PAGINATION_MAX_LIMIT = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _cursor_invalido() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido")
+
+
+def clave_orden(columnas: Sequence, descendente: bool = False) -> str:
+    """Identifica el orden de la consulta, p. ej. "-productos.precio,productos.id"."""
+    return ("-" if descendente else "") + ",".join(f"{c.table.name}.{c.key}" for c in columnas)
+
+
+def codificar_cursor(valores: Sequence, orden: str) -> str:
+    datos = {
+        "orden": orden,
+        "valores": [v.isoformat() if isinstance(v, datetime) else v for v in valores],
+    }
+    return base64.urlsafe_b64encode(json.dumps(datos, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _valor_de_columna(valor, columna):
+    """Valor del cursor convertido al tipo de `columna`; lanza 400 si no corresponde."""
+    if valor is None:
+        if columna.nullable:
+            return None
+        raise _cursor_invalido()
+    if isinstance(columna.type, DateTime):
+        if not isinstance(valor, str):
+            raise _cursor_invalido()
+        return datetime.fromisoformat(valor)
+    try:
+        tipo = columna.type.python_type
+    except NotImplementedError:
+        raise _cursor_invalido()
+    # bool es subclase de int: no se acepta como número
+    if isinstance(valor, bool) and tipo is not bool:
+        raise _cursor_invalido()
+    if tipo in (float, Decimal) and isinstance(valor, (int, float)):
+        return valor
+    if tipo in (int, str, bool) and isinstance(valor, tipo):
+        return valor
+    raise _cursor_invalido()
+
+
+def decodificar_cursor(cursor: str, columnas: Sequence, orden: str) -> list:
+    """Valores del cursor para `columnas`.
+
+    Lanza 400 si el cursor se generó con otro orden (u otra consulta) o si
+    algún valor no es del tipo de su columna: así nunca llega a la base un
+    parámetro que Postgres rechazaría con un error 500.
+    """
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(datos, dict) or datos.get("orden") != orden:
+            raise _cursor_invalido()
+        valores = datos.get("valores")
+        if not isinstance(valores, list) or len(valores) != len(columnas):
+            raise _cursor_invalido()
+        return [_valor_de_columna(valor, columna) for valor, columna in zip(valores, columnas)]
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise _cursor_invalido()
+
+
+async def paginar(
+    db: AsyncSession,
+    query: Select,
+    columnas: Sequence,
+    response: Response,
+    limit: int,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    descendente: bool = False,
+) -> list:
+    """Ejecuta `query` ordenada por `columnas` y devuelve una página de `limit` filas.
+
+    Con `cursor` filtra por `(columnas) > cursor` (o `<` si `descendente`), lo
+    que aprovecha el índice sobre esas columnas; sin cursor usa `skip`
+    (modo OFFSET, por compatibilidad). En ambos modos, si hay más filas se
+    agrega el cursor de la página siguiente en X-Next-Cursor. El cursor lleva
+    el orden con el que se generó y solo es válido para ese mismo orden.
+    """
+    clave = tuple_(*columnas)
+    orden = clave_orden(columnas, descendente)
+    if cursor:
+        valores = tuple_(*decodificar_cursor(cursor, columnas, orden))
+        query = query.where(clave < valores if descendente else clave > valores)
+    elif skip:
+        query = query.offset(skip)
+    query = query.order_by(*(c.desc() if descendente else c.asc() for c in columnas))
+
+    filas = (await db.scalars(query.limit(limit + 1))).all()
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        response.headers[NEXT_CURSOR_HEADER] = codificar_cursor([getattr(ultima, c.key) for c in columnas], orden)
+    return filas
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import bcrypt
+
+from services import metrics
+
+# bcrypt se ejecuta en un pool propio y acotado, separado del threadpool de
+# Starlette: una ráfaga de logins no deja sin hilos al resto de endpoints.
+# bcrypt libera el GIL mientras calcula, así que basta con hilos.
+#  - BCRYPT_ROUNDS: factor de trabajo de los hashes nuevos (4-31); los hashes
+#    con otro costo se recalculan de forma transparente en el login
+#  - BCRYPT_WORKERS: hashes calculados en paralelo
+#  - BCRYPT_MAX_PENDING: operaciones en curso + en cola antes de responder 503
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "32"))
+
+duration_histogram = metrics.histogram(
+    "bcrypt_seconds",
+    "Duración de cada hash o verificación bcrypt (incluida la espera en cola)",
+    [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+)
+rejected_counter = metrics.counter(
+    "bcrypt_rejected_total",
+    "Operaciones bcrypt rechazadas por tener el pool lleno",
+)
+
+
+class HasherSaturado(Exception):
+    """El pool de bcrypt alcanzó BCRYPT_MAX_PENDING operaciones."""
+
+
+def hashear(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def verificar(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        # Hash vacío o con formato inválido (p. ej. usuarios creados sin contraseña)
+        return False
+
+
+def costo(hashed: str) -> Optional[int]:
+    """Factor de trabajo de un hash `$2b$12$...`, o None si no es bcrypt."""
+    partes = (hashed or "").split("$")
+    if len(partes) < 4 or not partes[2].isdigit():
+        return None
+    return int(partes[2])
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        rounds: int = BCRYPT_ROUNDS,
+        workers: int = BCRYPT_WORKERS,
+        max_pending: int = BCRYPT_MAX_PENDING,
+    ):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pendientes = 0
+        metrics.gauge("bcrypt_pending", "Operaciones bcrypt en curso o en cola", lambda: self._pendientes)
+
+    async def _ejecutar(self, fn: Callable, *args):
+        if self._pendientes >= self.max_pending:
+            rejected_counter.inc()
+            raise HasherSaturado()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._pendientes += 1
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pendientes -= 1
+            duration_histogram.observe(time.perf_counter() - inicio)
+
+    async def hash(self, password: str) -> str:
+        return await self._ejecutar(hashear, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._ejecutar(verificar, password, hashed)
+
+    def necesita_rehash(self, hashed: str) -> bool:
+        return costo(hashed) != self.rounds
+
+    def cerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from database import IS_SQLITE, marcar_usuario_modificado
+from models import MovimientoPuntos, Usuario
+
+# Motivos registrados en el libro de movimientos
+MOTIVO_QR = "qr"
+MOTIVO_COMPRA = "compra"
+MOTIVO_RECOMPENSA = "recompensa"
+MOTIVO_CURSO = "curso"
+MOTIVO_SNAPSHOT = "snapshot"
+
+
+class UsuarioNoEncontrado(Exception):
+    """El usuario al que se le quieren mover puntos no existe."""
+
+
+class SaldoInsuficiente(Exception):
+    """El movimiento dejaría el saldo de CleanPoints en negativo."""
+
+
+async def aplicar_puntos(
+    db: AsyncSession,
+    usuario_id: int,
+    delta: int,
+    motivo: str,
+    origen_id: Optional[object] = None,
+    items_reciclados: int = 0,
+) -> int:
+    """Suma `delta` CleanPoints al usuario con un único UPDATE condicional.
+
+    El cálculo se hace en la base de datos (`cleanpoints = cleanpoints + delta`)
+    y la condición `cleanpoints + delta >= 0` evita saldos negativos, así que
+    requests concurrentes del mismo usuario no pierden actualizaciones. El
+    movimiento queda registrado en `movimientos_puntos` con su `motivo` y
+    `origen_id`. No hace commit: saldo y movimiento forman parte de la
+    transacción del request.
+
+    Devuelve el nuevo saldo. Lanza `SaldoInsuficiente` o `UsuarioNoEncontrado`
+    si no se actualizó ninguna fila.
+    """
+    nuevo_saldo = func.coalesce(Usuario.cleanpoints, 0) + delta
+    valores = {"cleanpoints": nuevo_saldo}
+    if items_reciclados:
+        valores["total_recycled_items"] = func.coalesce(Usuario.total_recycled_items, 0) + items_reciclados
+
+    result = await db.execute(
+        update(Usuario)
+        .where(Usuario.id == usuario_id, nuevo_saldo >= 0)
+        .values(**valores)
+        .returning(Usuario.cleanpoints, Usuario.total_recycled_items)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is None:
+        # Solo en el camino de error se averigua la causa
+        if await db.get(Usuario, usuario_id) is None:
+            raise UsuarioNoEncontrado(usuario_id)
+        raise SaldoInsuficiente(usuario_id)
+
+    db.add(MovimientoPuntos(
+        usuario_id=usuario_id,
+        delta=delta,
+        motivo=motivo,
+        origen_id=str(origen_id) if origen_id is not None else None,
+    ))
+    _sincronizar_usuario(db, usuario_id, row.cleanpoints, row.total_recycled_items)
+    marcar_usuario_modificado(db, usuario_id, row.cleanpoints)
+    return row.cleanpoints
+
+
+def _sincronizar_usuario(db: AsyncSession, usuario_id: int, cleanpoints: int, total_recycled_items: Optional[int]):
+    """Refleja los valores devueltos por RETURNING en el Usuario ya cargado en la sesión."""
+    usuario = db.identity_map.get(identity_key(Usuario, usuario_id))
+    if usuario is not None:
+        set_committed_value(usuario, "cleanpoints", cleanpoints)
+        set_committed_value(usuario, "total_recycled_items", total_recycled_items)
+
+
+def sembrar_saldos_iniciales(db: Session) -> int:
+    """Registra como snapshot el saldo de los usuarios que aún no tienen movimientos.
+
+    Los saldos anteriores a la existencia del libro no tienen historia; esta
+    fila de apertura hace que la suma del libro coincida con `cleanpoints`.
+    Es idempotente. Devuelve cuántos usuarios se sembraron.
+    """
+    sin_movimientos = ~select(MovimientoPuntos.id).where(MovimientoPuntos.usuario_id == Usuario.id).exists()
+    origen = select(
+        Usuario.id,
+        func.coalesce(Usuario.cleanpoints, 0),
+        literal(MOTIVO_SNAPSHOT),
+        func.coalesce(Usuario.fecha_registro, literal(datetime.utcnow())),
+        literal(True),
+    ).where(sin_movimientos, func.coalesce(Usuario.cleanpoints, 0) != 0)
+    result = db.execute(
+        insert(MovimientoPuntos).from_select(
+            ["usuario_id", "delta", "motivo", "fecha", "snapshot"], origen
+        )
+    )
+    return result.rowcount
+
+
+def compactar_movimientos(db: Session, antes_de: datetime) -> int:
+    """Resume en filas snapshot los movimientos anteriores a `antes_de`.
+
+    Por usuario se guardan a lo sumo dos snapshots (la suma de los créditos y la
+    de los débitos), así los totales ganados/gastados se conservan y la suma del
+    libro sigue siendo igual al saldo. Los snapshots previos también se vuelven a
+    plegar, de modo que el libro no crece sin límite. Devuelve cuántas filas se
+    eliminaron. No hace commit.
+
+    El resumen (INSERT ... SELECT) y el DELETE deben ver la misma foto de la
+    tabla: en READ COMMITTED un movimiento confirmado entre ambos se borraría
+    sin haberse sumado. Por eso en Postgres exige una transacción REPEATABLE
+    READ (ver compactar_puntos.py); SQLite ya serializa las escrituras.
+    """
+    if not IS_SQLITE and db.connection().get_isolation_level() not in ("REPEATABLE READ", "SERIALIZABLE"):
+        raise ValueError("compactar_movimientos requiere una transacción REPEATABLE READ")
+    ultimo_id = db.scalar(select(func.max(MovimientoPuntos.id)).where(MovimientoPuntos.fecha < antes_de))
+    if ultimo_id is None:
+        return 0
+    plegables = (MovimientoPuntos.id <= ultimo_id, MovimientoPuntos.fecha < antes_de)
+    es_credito = MovimientoPuntos.delta > 0
+
+    resumen = (
+        select(
+            MovimientoPuntos.usuario_id,
+            func.sum(MovimientoPuntos.delta),
+            literal(MOTIVO_SNAPSHOT),
+            literal(antes_de),
+            literal(True),
+        )
+        .where(*plegables)
+        .group_by(MovimientoPuntos.usuario_id, es_credito)
+        .having(func.sum(MovimientoPuntos.delta) != 0)
+    )
+    db.execute(
+        insert(MovimientoPuntos).from_select(
+            ["usuario_id", "delta", "motivo", "fecha", "snapshot"], resumen
+        )
+    )
+    result = db.execute(delete(MovimientoPuntos).where(*plegables))
+    return result.rowcount
@@ -0,0 +1,48 @@
+import os
+from typing import BinaryIO, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Preprocesamiento de fotos para el modelo: se decodifica directamente a baja
+# resolución en lugar de cargar la foto completa de la cámara (a menudo 12 MP)
+# para después reducirla.
+#  - MAX_IMAGE_PIXELS: píxeles máximos (ancho x alto) aceptados
+#  - MAX_IMAGE_SIDE: lado máximo aceptado en píxeles
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "10000"))
+
+
+class ImagenDemasiadoGrande(ValueError):
+    """Las dimensiones de la imagen superan MAX_IMAGE_PIXELS o MAX_IMAGE_SIDE."""
+
+
+def validar_dimensiones(image: Image.Image):
+    """Rechaza la imagen recién abierta (solo cabecera) si es demasiado grande.
+
+    Todo lo que decodifica una foto subida debe llamarla antes de tocar sus
+    píxeles: `draft()` solo reduce JPEG, y un PNG o WebP se decodifica entero.
+    """
+    w, h = image.size
+    if w * h > MAX_IMAGE_PIXELS or max(w, h) > MAX_IMAGE_SIDE:
+        raise ImagenDemasiadoGrande(f"{w}x{h}")
+
+
+def cargar_para_modelo(fp: BinaryIO, forma: Tuple[int, int]) -> np.ndarray:
+    """Decodifica la imagen de `fp` al tensor (alto, ancho, 3) float32 en [0, 1].
+
+    1. `Image.open` solo lee la cabecera: las dimensiones se validan antes de
+       decodificar un solo píxel.
+    2. Para JPEG, `draft()` pide al decodificador escalar en el dominio DCT
+       (1/2, 1/4 o 1/8) al menor tamaño que siga cubriendo `forma`, así nunca
+       se materializa la foto a resolución completa.
+    3. El resto de la reducción se hace con `resize(..., reducing_gap=...)`.
+    4. La conversión a float32 normalizado es una sola operación vectorizada
+       que produce un arreglo contiguo.
+    """
+    alto, ancho = forma
+    with Image.open(fp) as image:
+        validar_dimensiones(image)
+        image.draft("RGB", (ancho, alto))
+        image = image.convert("RGB").resize((ancho, alto), Image.BILINEAR, reducing_gap=2.0)
+        return np.divide(np.asarray(image), 255.0, dtype=np.float32)
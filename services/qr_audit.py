@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from database import async_engine
+from models import QRTransaction
+from services import metrics
+
+# Auditoría de validaciones QR con escritura diferida (write-behind): el
+# request solo agrega la fila a un buffer en memoria y una tarea de fondo la
+# inserta junto con las demás en un único INSERT de varias filas.
+#  - QR_AUDIT_FLUSH_ROWS: filas por INSERT; al llegar a este número se vacía
+#    el buffer sin esperar al intervalo
+#  - QR_AUDIT_FLUSH_MS: intervalo máximo entre escrituras
+#  - QR_AUDIT_MAX_BUFFER: filas en memoria (p. ej. con la base caída) antes de
+#    descartar las nuevas
+# Al apagar el servidor se vacía el buffer; si la base no está disponible en
+# ese momento, las filas restantes se cuentan en qr_audit_rows_dropped_total.
+# Si el proceso muere sin apagarse, se pierden a lo sumo las filas de un
+# intervalo: es un registro de auditoría, los puntos ya quedaron en
+# `movimientos_puntos`.
+QR_AUDIT_FLUSH_ROWS = int(os.getenv("QR_AUDIT_FLUSH_ROWS", "100"))
+QR_AUDIT_FLUSH_MS = int(os.getenv("QR_AUDIT_FLUSH_MS", "500"))
+QR_AUDIT_MAX_BUFFER = int(os.getenv("QR_AUDIT_MAX_BUFFER", "10000"))
+
+flush_histogram = metrics.histogram(
+    "qr_audit_flush_seconds",
+    "Duración de cada escritura por lotes de la auditoría QR",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+written_counter = metrics.counter("qr_audit_rows_written_total", "Filas de auditoría QR insertadas")
+dropped_counter = metrics.counter("qr_audit_rows_dropped_total", "Filas de auditoría QR descartadas (buffer lleno o rechazadas por la base)")
+errors_counter = metrics.counter("qr_audit_flush_errors_total", "Escrituras de auditoría QR fallidas (se reintentan)")
+
+
+class BufferAuditoria:
+    def __init__(
+        self,
+        flush_rows: int = QR_AUDIT_FLUSH_ROWS,
+        flush_ms: int = QR_AUDIT_FLUSH_MS,
+        max_buffer: int = QR_AUDIT_MAX_BUFFER,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self.max_buffer = max_buffer
+        self._filas: Deque[dict] = deque()
+        self._lleno: Optional[asyncio.Event] = None
+        self._detener: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._tarea: Optional[asyncio.Task] = None
+        metrics.gauge("qr_audit_buffer_rows", "Filas de auditoría QR esperando ser escritas", lambda: len(self._filas))
+
+    def start(self):
+        if self._tarea is None:
+            self._lleno = asyncio.Event()
+            self._detener = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._tarea = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene la tarea de fondo y escribe lo que quede en el buffer."""
+        if self._tarea is None:
+            return
+        # Sin cancelar la tarea: si está a mitad de un INSERT lo termina y sale
+        self._detener.set()
+        self._lleno.set()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+        await self.vaciar()
+        if self._filas:
+            dropped_counter.inc(len(self._filas))
+            print(f"Auditoría QR: {len(self._filas)} filas descartadas al apagar (base no disponible)")
+            self._filas.clear()
+
+    def registrar(self, user_id: int, container_id: str, points_awarded: int, validated: bool,
+                  image_url: Optional[str] = None, created_at: Optional[datetime] = None):
+        """Agrega una validación al buffer; no toca la base de datos."""
+        if len(self._filas) >= self.max_buffer:
+            dropped_counter.inc()
+            return
+        self._filas.append({
+            "user_id": user_id,
+            "container_id": container_id,
+            "image_url": image_url,
+            "points_awarded": points_awarded,
+            "validated": validated,
+            "created_at": created_at or datetime.utcnow(),
+        })
+        if len(self._filas) >= self.flush_rows and self._lleno is not None:
+            self._lleno.set()
+
+    async def _run(self):
+        while not self._detener.is_set():
+            try:
+                await asyncio.wait_for(self._lleno.wait(), timeout=self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._lleno.clear()
+            await self.vaciar()
+
+    async def vaciar(self):
+        """Escribe el buffer en lotes de `flush_rows` filas, un INSERT por lote."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._filas:
+                lote = [self._filas.popleft() for _ in range(min(self.flush_rows, len(self._filas)))]
+                inicio = time.perf_counter()
+                try:
+                    await self._insertar(lote)
+                except Exception as e:
+                    # Base no disponible: devolver el lote al frente y reintentar
+                    # en el próximo intervalo
+                    errors_counter.inc()
+                    self._filas.extendleft(reversed(lote))
+                    print(f"Error escribiendo la auditoría QR ({len(lote)} filas): {e}")
+                    return
+                except BaseException:
+                    # Cancelada a mitad del INSERT: el lote vuelve al buffer
+                    self._filas.extendleft(reversed(lote))
+                    raise
+                flush_histogram.observe(time.perf_counter() - inicio)
+
+    async def _insertar(self, lote: list):
+        try:
+            async with async_engine.begin() as conn:
+                await conn.execute(insert(QRTransaction).values(lote))
+            written_counter.inc(len(lote))
+        except IntegrityError:
+            # Una fila inválida (p. ej. de un usuario ya borrado) no debe
+            # bloquear al resto: se reintenta fila por fila y se descarta esa
+            for fila in lote:
+                try:
+                    async with async_engine.begin() as conn:
+                        await conn.execute(insert(QRTransaction).values(fila))
+                    written_counter.inc()
+                except IntegrityError:
+                    dropped_counter.inc()
+
+
+qr_auditoria = BufferAuditoria()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from services import metrics
+
+# Caché de respuestas del catálogo (cursos y productos): guarda el JSON ya
+# serializado con su ETag fuerte, por ruta y parámetros de consulta. Los
+# endpoints de escritura invalidan su espacio de nombres al confirmar.
+#  - RESPONSE_CACHE_MAX_BYTES: presupuesto de memoria de los cuerpos cacheados
+# La caché es por proceso: con varios workers de uvicorn cada uno invalida
+# solo la suya, así que conviene usarla con un único worker o aceptar que un
+# cambio tarde en verse en los demás hasta su próxima escritura.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Cabeceras de la respuesta original que se guardan junto al cuerpo
+CABECERAS_CACHEADAS = ("X-Next-Cursor",)
+
+hits_counter = metrics.counter("response_cache_hits_total", "Respuestas del catálogo servidas desde la caché")
+misses_counter = metrics.counter("response_cache_misses_total", "Respuestas del catálogo generadas con la base de datos")
+not_modified_counter = metrics.counter("response_cache_not_modified_total", "Respuestas 304 por If-None-Match")
+
+
+class RespuestaCacheada(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+
+
+def calcular_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def coincide_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110), con soporte de `*` y listas."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(valor.strip().removeprefix("W/") == etag for valor in if_none_match.split(","))
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entradas: "OrderedDict[tuple, RespuestaCacheada]" = OrderedDict()
+        self._bytes = 0
+        # Versión por espacio de nombres: una respuesta generada antes de una
+        # invalidación concurrente no se guarda
+        self._versiones: Dict[str, int] = {}
+        metrics.gauge("response_cache_bytes", "Bytes de respuestas en la caché del catálogo", lambda: self._bytes)
+        metrics.gauge("response_cache_entries", "Respuestas en la caché del catálogo", lambda: len(self._entradas))
+
+    def buscar(self, clave: tuple) -> Optional[RespuestaCacheada]:
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            misses_counter.inc()
+            return None
+        self._entradas.move_to_end(clave)
+        hits_counter.inc()
+        return entrada
+
+    def version(self, espacio: str) -> int:
+        return self._versiones.get(espacio, 0)
+
+    def guardar(self, clave: tuple, entrada: RespuestaCacheada, version: int):
+        if version != self.version(clave[0]) or len(entrada.body) > self.max_bytes:
+            return
+        self._quitar(clave)
+        self._entradas[clave] = entrada
+        self._bytes += len(entrada.body)
+        while self._bytes > self.max_bytes:
+            self._quitar(next(iter(self._entradas)))
+
+    def invalidar(self, espacio: str):
+        """Descarta todas las respuestas de `espacio` (p. ej. "cursos")."""
+        self._versiones[espacio] = self.version(espacio) + 1
+        for clave in [c for c in self._entradas if c[0] == espacio]:
+            self._quitar(clave)
+
+    def _quitar(self, clave: tuple):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= len(entrada.body)
+
+    async def responder(
+        self,
+        espacio: str,
+        request: Request,
+        adapter: TypeAdapter,
+        generar: Callable[[Response], Awaitable[Any]],
+    ) -> Response:
+        """Responde desde la caché o con `generar(response)`, serializado con `adapter`.
+
+        `generar` recibe un Response donde puede fijar cabeceras (p. ej.
+        X-Next-Cursor), igual que un endpoint normal. Si el If-None-Match del
+        cliente coincide con el ETag responde 304 sin cuerpo.
+        """
+        clave = (espacio, request.url.path, tuple(sorted(request.query_params.multi_items())))
+        entrada = self.buscar(clave)
+        if entrada is None:
+            version = self.version(espacio)
+            parcial = Response()
+            datos = await generar(parcial)
+            body = adapter.dump_json(adapter.validate_python(datos, from_attributes=True))
+            headers = {h: parcial.headers[h] for h in CABECERAS_CACHEADAS if h in parcial.headers}
+            entrada = RespuestaCacheada(body, calcular_etag(body), headers)
+            self.guardar(clave, entrada, version)
+
+        headers = {"ETag": entrada.etag, "Cache-Control": "no-cache", **entrada.headers}
+        if coincide_etag(request.headers.get("if-none-match"), entrada.etag):
+            not_modified_counter.inc()
+            return Response(status_code=304, headers=headers)
+        return Response(content=entrada.body, media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache()
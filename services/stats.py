@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import date, datetime, time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import IS_SQLITE
+from models import EstadisticaGlobalHora, EstadisticaUsuarioDia, QRTransaction
+
+# Estadísticas de reciclaje preagregadas (rollups): una fila por usuario y día
+# y una por hora para toda la plataforma. Cada validación exitosa suma 1 con
+# un upsert (INSERT ... ON CONFLICT DO UPDATE) en la misma transacción que
+# otorga los puntos, así los rollups nunca cuentan una validación cuyos
+# puntos se deshicieron. Los endpoints de /stats leen solo estas tablas.
+# Todas las fechas son UTC, igual que `created_at` en qr_transactions.
+
+# Filas de qr_transactions leídas por consulta al reconstruir
+LOTE_RECONSTRUCCION = 5000
+
+
+def inicio_hora(momento: datetime) -> datetime:
+    return momento.replace(minute=0, second=0, microsecond=0)
+
+
+def _sumar(modelo, claves: dict, validaciones: int, cleanpoints: int):
+    stmt = (sqlite.insert if IS_SQLITE else postgresql.insert)(modelo).values(
+        **claves, validaciones=validaciones, cleanpoints=cleanpoints
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=list(claves),
+        set_={
+            "validaciones": modelo.validaciones + stmt.excluded.validaciones,
+            "cleanpoints": modelo.cleanpoints + stmt.excluded.cleanpoints,
+        },
+    )
+
+
+async def registrar_validacion(db: AsyncSession, usuario_id: int, cleanpoints: int, momento: datetime):
+    """Suma una validación exitosa a los rollups del usuario y de la hora. No hace commit."""
+    await db.execute(_sumar(EstadisticaUsuarioDia, {"usuario_id": usuario_id, "dia": momento.date()}, 1, cleanpoints))
+    await db.execute(_sumar(EstadisticaGlobalHora, {"hora": inicio_hora(momento)}, 1, cleanpoints))
+
+
+def reconstruir_estadisticas(db: Session, desde: Optional[date] = None, lote: int = LOTE_RECONSTRUCCION) -> Tuple[int, int, int]:
+    """Recalcula los rollups desde `qr_transactions` (a partir del día `desde`, o todos).
+
+    Lee el registro por lotes de `lote` filas paginando por id, así la
+    memoria depende del número de filas de rollup y no del tamaño del
+    registro. Reemplaza los rollups del rango en la transacción de `db`; no
+    hace commit. Devuelve (transacciones leídas, filas por día, filas por hora).
+    """
+    por_dia: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0])
+    por_hora: Dict[datetime, List[int]] = defaultdict(lambda: [0, 0])
+    inicio = datetime.combine(desde, time.min) if desde else None
+
+    leidas, ultimo_id = 0, 0
+    while True:
+        query = (
+            select(QRTransaction.id, QRTransaction.user_id, QRTransaction.points_awarded, QRTransaction.created_at)
+            .where(QRTransaction.validated.is_(True), QRTransaction.id > ultimo_id)
+            .order_by(QRTransaction.id)
+            .limit(lote)
+        )
+        if inicio is not None:
+            query = query.where(QRTransaction.created_at >= inicio)
+        filas = db.execute(query).all()
+        if not filas:
+            break
+        for fila in filas:
+            for acumulado in (por_dia[(fila.user_id, fila.created_at.date())], por_hora[inicio_hora(fila.created_at)]):
+                acumulado[0] += 1
+                acumulado[1] += fila.points_awarded or 0
+        leidas += len(filas)
+        ultimo_id = filas[-1].id
+
+    borrar_dias = delete(EstadisticaUsuarioDia)
+    borrar_horas = delete(EstadisticaGlobalHora)
+    if inicio is not None:
+        borrar_dias = borrar_dias.where(EstadisticaUsuarioDia.dia >= desde)
+        borrar_horas = borrar_horas.where(EstadisticaGlobalHora.hora >= inicio)
+    db.execute(borrar_dias)
+    db.execute(borrar_horas)
+
+    filas_dia = [
+        {"usuario_id": usuario_id, "dia": dia, "validaciones": v, "cleanpoints": p}
+        for (usuario_id, dia), (v, p) in por_dia.items()
+    ]
+    filas_hora = [{"hora": hora, "validaciones": v, "cleanpoints": p} for hora, (v, p) in por_hora.items()]
+    for modelo, filas in ((EstadisticaUsuarioDia, filas_dia), (EstadisticaGlobalHora, filas_hora)):
+        for i in range(0, len(filas), lote):
+            db.execute(insert(modelo), filas[i:i + lote])
+    return leidas, len(filas_dia), len(filas_hora)
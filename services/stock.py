@@ -0,0 +1,110 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from models import Producto
+from services import metrics
+
+# Reserva de stock para compras concurrentes. La reserva es un único UPDATE
+# condicional (`stock = stock - n WHERE stock >= n`) dentro de la transacción
+# de la compra: dos compradores nunca leen el mismo stock para luego
+# escribirlo, así que no hay sobreventa. En Postgres el UPDATE toma el lock
+# de la fila hasta el commit y los demás compradores del mismo producto
+# esperan ese lock (SKIP LOCKED no aplica: hay un contador por producto, no
+# una fila por unidad).
+#
+# Cola opcional por producto (STOCK_QUEUE_ENABLED=1): en un lanzamiento con
+# un producto muy demandado los compradores esperan su turno en memoria, en
+# vez de ocupar cada uno una conexión del pool esperando el lock de la fila.
+#  - STOCK_QUEUE_MAX_WAITERS: compradores en espera por producto antes de 503
+STOCK_QUEUE_ENABLED = os.getenv("STOCK_QUEUE_ENABLED", "0") == "1"
+STOCK_QUEUE_MAX_WAITERS = int(os.getenv("STOCK_QUEUE_MAX_WAITERS", "200"))
+
+sold_out_counter = metrics.counter("stock_sold_out_total", "Compras rechazadas por falta de stock")
+queue_rejected_counter = metrics.counter("stock_queue_rejected_total", "Compras rechazadas por tener la cola del producto llena")
+
+
+class ProductoNoEncontrado(Exception):
+    """El producto que se quiere reservar no existe."""
+
+
+class SinStock(Exception):
+    """No queda stock suficiente del producto."""
+
+
+class ColaReservasLlena(Exception):
+    """El producto ya tiene STOCK_QUEUE_MAX_WAITERS compradores esperando."""
+
+
+async def reservar_stock(db: AsyncSession, producto_id: int, cantidad: int = 1) -> Optional[int]:
+    """Descuenta `cantidad` unidades del stock con un único UPDATE condicional.
+
+    Los productos con `stock` NULL no llevan control de inventario y siempre
+    se pueden comprar. No hace commit: la reserva se deshace si la compra
+    falla después (p. ej. por saldo insuficiente).
+
+    Devuelve el stock restante (None si no se controla). Lanza `SinStock` o
+    `ProductoNoEncontrado` si no se actualizó ninguna fila.
+    """
+    result = await db.execute(
+        update(Producto)
+        .where(Producto.id == producto_id, or_(Producto.stock.is_(None), Producto.stock >= cantidad))
+        .values(stock=Producto.stock - cantidad)
+        .returning(Producto.stock)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is None:
+        if await db.get(Producto, producto_id) is None:
+            raise ProductoNoEncontrado(producto_id)
+        sold_out_counter.inc()
+        raise SinStock(producto_id)
+
+    # Reflejar el stock nuevo en el producto si ya está cargado en la sesión
+    producto = db.identity_map.get(identity_key(Producto, producto_id))
+    if producto is not None:
+        set_committed_value(producto, "stock", row.stock)
+    return row.stock
+
+
+class ColaReservas:
+    """Un turno a la vez por producto; los demás compradores esperan en memoria."""
+
+    def __init__(self, enabled: bool = STOCK_QUEUE_ENABLED, max_waiters: int = STOCK_QUEUE_MAX_WAITERS):
+        self.enabled = enabled
+        self.max_waiters = max_waiters
+        # producto_id -> [lock, compradores esperando o comprando]
+        self._colas: Dict[int, list] = {}
+        metrics.gauge(
+            "stock_queue_waiters",
+            "Compradores esperando turno en las colas de reserva",
+            lambda: sum(cola[1] for cola in self._colas.values()),
+        )
+
+    @asynccontextmanager
+    async def turno(self, producto_id: int):
+        """Debe abarcar toda la transacción de la compra, commit incluido."""
+        if not self.enabled:
+            yield
+            return
+        cola = self._colas.setdefault(producto_id, [asyncio.Lock(), 0])
+        if cola[1] >= self.max_waiters:
+            queue_rejected_counter.inc()
+            raise ColaReservasLlena(producto_id)
+        cola[1] += 1
+        try:
+            async with cola[0]:
+                yield
+        finally:
+            cola[1] -= 1
+            if cola[1] == 0:
+                del self._colas[producto_id]
+
+
+reservas = ColaReservas()
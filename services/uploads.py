@@ -0,0 +1,57 @@
+from typing import AsyncGenerator
+
+from fastapi import HTTPException, Request, status
+from starlette.datastructures import FormData
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+
+def _demasiado_grande(limite: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"El archivo supera el tamaño máximo permitido ({limite / (1024 * 1024):.1f} MB)",
+    )
+
+
+class _CuerpoDemasiadoGrande(MultiPartException):
+    """El stream superó el límite durante el parseo.
+
+    Es una MultiPartException para que MultiPartParser cierre los archivos
+    temporales que ya había creado; `leer_formulario` la convierte en 413.
+    """
+
+
+async def _stream_limitado(request: Request, limite: int) -> AsyncGenerator[bytes, None]:
+    recibidos = 0
+    async for chunk in request.stream():
+        recibidos += len(chunk)
+        if recibidos > limite:
+            raise _CuerpoDemasiadoGrande("El cuerpo supera el tamaño máximo permitido")
+        yield chunk
+
+
+async def leer_formulario(request: Request, limite: int, max_files: int = 1) -> FormData:
+    """Lee un cuerpo multipart/form-data en streaming con un límite de tamaño duro.
+
+    Los archivos se escriben a medida que llegan en un SpooledTemporaryFile
+    (memoria hasta 1 MB, luego disco), sin copias intermedias del cuerpo
+    completo. El límite se verifica con Content-Length y también mientras se
+    lee el stream, por si la cabecera falta o miente. El llamador debe cerrar
+    el formulario (`await form.close()`).
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Se esperaba multipart/form-data",
+        )
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limite:
+        raise _demasiado_grande(limite)
+
+    parser = MultiPartParser(request.headers, _stream_limitado(request, limite), max_files=max_files)
+    try:
+        return await parser.parse()
+    except _CuerpoDemasiadoGrande:
+        raise _demasiado_grande(limite)
+    except MultiPartException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)